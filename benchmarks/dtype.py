@@ -0,0 +1,85 @@
+"""
+Compare float32 and float64 computation of the group PCA and FastICA
+stages of CanICA on synthetic data.
+
+Reports wall time of each precision, the speedup of float32, and the
+accuracy of each precision as the correlation of the recovered
+components with the true sources.
+
+Usage:
+
+    python benchmarks/dtype.py [n_vertices] [n_timepoints] [n_components]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from meshica.canica import CanICA
+from meshica.instrumentation import FitStats
+
+from synthetic import recovery
+
+
+def synthetic(n_vertices, n_timepoints, n_components, random_state=0):
+
+    """
+    Mix sparse spatial sources with random time courses and add noise.
+
+    :return data: (time x vertices) group matrix
+    :return sources: (components x vertices) true spatial sources
+    """
+
+    rng = np.random.RandomState(random_state)
+
+    sources = rng.laplace(size=(n_components, n_vertices))
+    timecourses = rng.randn(n_timepoints, n_components)
+    data = np.dot(timecourses, sources) + rng.randn(n_timepoints, n_vertices)
+
+    return data, sources
+
+
+def run(data, n_components, dtype):
+
+    model = CanICA(n_components=n_components, n_init=4, random_state=0,
+                   threshold=None, dtype=dtype)
+    model.mask = np.zeros((data.shape[1],), dtype=bool)
+    model.fit_stats_ = FitStats()
+
+    data = data.astype(dtype)
+
+    start = time.time()
+    model._raw_fit(data)
+    model._unmix_components()
+    elapsed = time.time() - start
+
+    return model.components_, elapsed
+
+
+if __name__ == '__main__':
+
+    n_vertices = int(sys.argv[1]) if len(sys.argv) > 1 else 32000
+    n_timepoints = int(sys.argv[2]) if len(sys.argv) > 2 else 1200
+    n_components = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    data, sources = synthetic(n_vertices, n_timepoints, n_components)
+
+    # start the worker pool before timing
+    run(data[:, :1000], n_components, np.float64)
+
+    results = {}
+    for dtype in [np.float64, np.float32]:
+        np.random.seed(0)
+        results[dtype] = run(data, n_components, dtype)
+
+    components_64, time_64 = results[np.float64]
+    components_32, time_32 = results[np.float32]
+
+    print('vertices: %i, timepoints: %i, components: %i' % (n_vertices, n_timepoints, n_components))
+    recovery_64 = recovery(components_64, sources)
+    recovery_32 = recovery(components_32, sources)
+
+    print('float64: %.2f s, source recovery %.4f' % (time_64, recovery_64))
+    print('float32: %.2f s, source recovery %.4f' % (time_32, recovery_32))
+    print('speedup: %.2fx, accuracy delta: %.2e' % (time_64 / time_32, recovery_64 - recovery_32))
@@ -0,0 +1,137 @@
+"""
+Time, memory and source-recovery benchmarks of the decomposition
+pipelines on synthetic cohorts.
+
+Each estimator is fit in a fresh process, so that the reported peak RSS
+belongs to that fit alone.  For every run the wall time, peak RSS, the
+accuracy of the recovered components (mean best absolute correlation
+with the true sources) and the per-stage times from ``fit_stats_`` are
+reported, so that optimizations can be checked for both speed and
+correctness regressions.
+
+Usage:
+
+    python benchmarks/pipelines.py [--scales small medium] [--estimators canica migp]
+                                   [--directory /tmp/meshica-benchmarks] [--output results.jsonl]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from synthetic import cohort, recovery
+
+# (subjects, vertices, timepoints, components)
+SCALES = {'small': (4, 2000, 200, 10),
+          'medium': (8, 8000, 400, 20),
+          'large': (16, 32000, 1200, 20)}
+
+ESTIMATORS = ['canica', 'migp', 'ica', 'regressor']
+
+
+def fit(estimator, files, spatial, n_components):
+
+    """
+    Fit one estimator, and measure it from inside the worker process.
+    """
+
+    from meshica.canica import CanICA
+    from meshica.dual_regression import Regressor
+    from meshica.ica import ICA
+    from meshica.instrumentation import peak_rss
+    from meshica.migp import MIGP
+
+    start = time.perf_counter()
+
+    if estimator == 'canica':
+        model = CanICA(n_components=n_components, n_init=4, random_state=0,
+                       threshold=None, dtype=np.float32)
+        model.fit(files)
+        components = model.components_
+    elif estimator == 'migp':
+        n_timepoints = np.load(files[0], mmap_mode='r').shape[1]
+        model = MIGP(n_components=n_components, m_eigen=min(2*n_timepoints, spatial.shape[1]),
+                     s_init=2, n_init=4, random_state=0, dtype=np.float32)
+        model.fit(files)
+        components = model.components_
+    elif estimator == 'ica':
+        model = ICA(n_components=n_components, n_init=4, random_state=0,
+                    threshold=None, dtype=np.float32)
+        model.fit(files[0])
+        components = model.components_
+    else:
+        model = Regressor(hdr_alpha=None, precompute=True, dtype=np.float32)
+        model.fit(np.load(files[0]), spatial.T)
+        components = model.spatial_
+
+    elapsed = time.perf_counter() - start
+
+    return {'wall_time': elapsed,
+            'peak_rss': peak_rss(),
+            'recovery': float(recovery(components, spatial)),
+            'stages': model.fit_stats_.summary()}
+
+
+def run(estimator, scale, directory):
+
+    n_subjects, n_vertices, n_timepoints, n_components = SCALES[scale]
+    files, spatial = cohort(os.path.join(directory, scale), n_subjects, n_vertices,
+                            n_timepoints, n_components)
+
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        result = pool.apply(fit, (estimator, files, spatial, n_components))
+
+    result.update({'estimator': estimator,
+                   'scale': scale,
+                   'subjects': n_subjects,
+                   'vertices': n_vertices,
+                   'timepoints': n_timepoints,
+                   'components': n_components})
+
+    return result
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark decomposition pipelines on synthetic data.')
+
+    parser.add_argument('--scales',
+                        help='Cohort sizes to benchmark.',
+                        nargs='+',
+                        choices=sorted(SCALES),
+                        default=['small'])
+    parser.add_argument('--estimators',
+                        help='Estimators to benchmark.',
+                        nargs='+',
+                        choices=ESTIMATORS,
+                        default=ESTIMATORS)
+    parser.add_argument('--directory',
+                        help='Directory in which synthetic cohorts are written.',
+                        type=str,
+                        default=os.path.join('/tmp', 'meshica-benchmarks'))
+    parser.add_argument('--output',
+                        help='JSON lines file to append results to.',
+                        type=str,
+                        default=None)
+
+    args = parser.parse_args()
+
+    print('%-10s %-8s %10s %12s %10s' % ('estimator', 'scale', 'time (s)', 'peak (MB)', 'recovery'))
+
+    for scale in args.scales:
+        for estimator in args.estimators:
+
+            result = run(estimator, scale, args.directory)
+
+            peak = result['peak_rss']
+            print('%-10s %-8s %10.2f %12s %10.4f' % (estimator, scale, result['wall_time'],
+                  'n/a' if peak is None else '%.1f' % (peak / 2.**20), result['recovery']))
+
+            if args.output is not None:
+                with open(args.output, 'a') as f:
+                    f.write(json.dumps(result) + '\n')
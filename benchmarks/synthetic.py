@@ -0,0 +1,90 @@
+"""
+Synthetic surface time series with known spatial sources, shared by the
+benchmarks.
+
+Each subject is a (vertices x timepoints) matrix, generated by mixing the
+same sparse spatial sources with subject-specific time courses and adding
+Gaussian noise.  Subjects are written to .npy files, so that estimators
+read them through the same loading path as real data.
+"""
+
+import os
+
+import numpy as np
+
+
+def sources(n_vertices, n_components, random_state=0):
+
+    """
+    Sparse (Laplacian) spatial sources.
+
+    :return sources: (components x vertices) true spatial sources
+    """
+
+    rng = np.random.RandomState(random_state)
+
+    return rng.laplace(size=(n_components, n_vertices))
+
+
+def subject(spatial, n_timepoints, noise=1., random_state=0, dtype=np.float32):
+
+    """
+    Mix spatial sources with random time courses and add noise.
+
+    :param spatial: (components x vertices) spatial sources
+    :param n_timepoints: number of timepoints
+    :param noise: standard deviation of the noise
+    :return matrix: (vertices x timepoints) subject matrix
+    """
+
+    rng = np.random.RandomState(random_state)
+
+    timecourses = rng.randn(n_timepoints, spatial.shape[0])
+    matrix = np.dot(timecourses, spatial).T
+    matrix += noise*rng.randn(*matrix.shape)
+
+    return matrix.astype(dtype)
+
+
+def cohort(directory, n_subjects, n_vertices, n_timepoints, n_components,
+           noise=1., random_state=0):
+
+    """
+    Write a synthetic cohort to disk.
+
+    Subjects that already exist are not regenerated.
+
+    :param directory: directory in which subject files are written
+    :return files: list of subject files
+    :return spatial: (components x vertices) true spatial sources
+    """
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    spatial = sources(n_vertices, n_components, random_state)
+
+    files = []
+    for s in range(n_subjects):
+        filename = os.path.join(directory, 'subject_%04i.npy' % (s))
+        if not os.path.isfile(filename):
+            np.save(filename, subject(spatial, n_timepoints, noise, random_state+s+1))
+        files.append(filename)
+
+    return files, spatial
+
+
+def recovery(components, spatial):
+
+    """
+    Mean over true sources of the best absolute correlation with a
+    recovered component.
+
+    :param components: (vertices x components) recovered components
+    :param spatial: (components x vertices) true spatial sources
+    """
+
+    n = spatial.shape[0]
+    correlation = np.corrcoef(spatial, np.asarray(components).T)[:n, n:]
+
+    return np.abs(correlation).max(1).mean()
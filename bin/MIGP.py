@@ -1,7 +1,10 @@
 import argparse
+import logging
 import os
 
 from meshica import migp
+from meshica.masking import VertexMask
+from meshica.results import save_results
 from niio import loaded
 import numpy as np
 import scipy.io as sio
@@ -54,6 +57,56 @@ parser.add_argument('-m',
                     required=False, 
                     type=str,
                     default=None)
+parser.add_argument('--svd-method',
+                    help='Method used to fold subjects into the reduced basis.',
+                    required=False,
+                    type=str,
+                    choices=['randomized', 'incremental'],
+                    default='randomized')
+parser.add_argument('--prefetch',
+                    help='Number of subjects to load ahead of the current update.',
+                    required=False,
+                    type=int,
+                    default=0)
+parser.add_argument('--checkpoint',
+                    help='Checkpoint file.  If it exists, the run is resumed from it.',
+                    required=False,
+                    type=str,
+                    default=None)
+parser.add_argument('-w',
+                    '--workers',
+                    help='Number of partitions to reduce in parallel.',
+                    required=False,
+                    type=int,
+                    default=1)
+parser.add_argument('-j',
+                    '--n-jobs',
+                    help='Number of FastICA restarts to run in parallel.',
+                    required=False,
+                    type=int,
+                    default=4)
+parser.add_argument('--backend',
+                    help='Joblib parallel backend for FastICA restarts.',
+                    required=False,
+                    type=str,
+                    default=None)
+parser.add_argument('--blas-threads',
+                    help='BLAS threads per parallel worker.',
+                    required=False,
+                    type=int,
+                    default=None)
+parser.add_argument('--format',
+                    help='Output format.  npy and hdf5 stores hold the masked components, '
+                         'mask index and fit parameters.',
+                    required=False,
+                    type=str,
+                    choices=['mat', 'npy', 'hdf5'],
+                    default='mat')
+parser.add_argument('--stats-log',
+                    help='JSON lines file of the time and memory of each stage.',
+                    required=False,
+                    type=str,
+                    default=None)
 parser.add_argument('-s',
                     '--size',
                     help='Downsample the number of files.',
@@ -63,6 +116,8 @@ parser.add_argument('-s',
 
 args = parser.parse_args()
 
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
 with open(args.file_list, 'r') as f:
     files = f.read().split()
 np.random.shuffle(files)
@@ -70,6 +125,13 @@ np.random.shuffle(files)
 if args.size:
     files = files[:args.size]
 
+resume = None
+if args.checkpoint and os.path.isfile(args.checkpoint):
+    with np.load(args.checkpoint) as checkpoint:
+        files = list(checkpoint['files'])
+    resume = args.checkpoint
+
+mask = None
 if args.mask:
     mask = loaded.load(args.mask)
 
@@ -79,17 +141,35 @@ M = migp.MIGP(n_components=args.number_components,
               m_eigen=args.eigens,
               s_init=args.number_subjects,
               t_r=args.rep_time,
-              mask=mask)
+              mask=mask,
+              svd_method=args.svd_method,
+              prefetch=args.prefetch,
+              checkpoint=args.checkpoint,
+              n_workers=args.workers,
+              n_jobs=args.n_jobs,
+              backend=args.backend,
+              blas_threads=args.blas_threads,
+              stats_log=args.stats_log)
 
-M.fit(files)
+M.fit(files, resume=resume)
 components = M.components_
 
-if args.mask:
-    C = np.zeros((mask.shape[0], components.shape[1]))
-    C[np.where(mask),:] = components)
-    components = {'components': C}
-else:
-    components = {'components': components}
+if mask is not None:
+    mask = VertexMask(mask)
 
 print('Saving gICA components...')
-sio.savemat(file_name=args.output, mdict=components)
+with M.fit_stats_.stage('write'):
+    if args.format == 'mat':
+        if mask is not None:
+            components = mask.scatter(components)
+        sio.savemat(file_name=args.output, mdict={'components': components})
+    else:
+        metadata = {'n_components': args.number_components,
+                    'm_eigen': args.eigens,
+                    's_init': args.number_subjects,
+                    'low_pass': args.low_pass,
+                    't_r': args.rep_time,
+                    'svd_method': args.svd_method,
+                    'files': files}
+        save_results(args.output, {'components': components}, mask=mask,
+                     metadata=metadata, format=args.format)
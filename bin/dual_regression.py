@@ -1,96 +1,309 @@
-import argparse, os
+import argparse
+import glob
+import logging
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 
 from meshica import dual_regression as dr
-import numpy as np
-from niio import loaded, write
+from meshica.loading import as_array, load
+from meshica.masking import VertexMask
+from meshica.parallel import blas_threads_per_worker, call_with_blas_limit
+from meshica.results import save_results
+from niio import loaded
 import scipy.io as sio
 
-def main(args):
 
-    components = loaded.load(args.components)
-    rest = loaded.load(args.rest)
-    
+# group components, mask and regressor shared by all subjects in a worker
+_shared = {}
+
+
+def load_components(args):
+
+    components = load(args.components)
+    mask = None
+
     if args.mask:
-        mask = loaded.load(args.mask)
-        components = components[np.where(mask)]
-        rest = rest[np.where(mask),:]
-        rest = rest.squeeze()
-
-    # instantiate dual regressor
-    Regressor = dr.Regressor(standardize=args.standardize, 
-                             hdr_alpha=args.alpha, 
-                             tr=args.rep_time,
-                             s_filter=args.filter)
-    
+        mask = VertexMask(loaded.load(args.mask))
+        components = mask.apply(components)
+
+    return as_array(components), mask
+
+
+def build_regressor(args):
+
+    return dr.Regressor(standardize=args.standardize,
+                        hdr_alpha=args.alpha,
+                        tr=args.rep_time,
+                        s_filter=args.filter,
+                        precompute=True,
+                        chunk_size=args.chunk_size,
+                        stats_log=args.stats_log)
+
+
+def output_files(output, format='mat'):
+
+    """
+    List the files written for a subject with output base name ``output``.
+    """
+
+    if format == 'mat':
+        return ['.'.join([output, 'Temporal.mat']), '.'.join([output, 'Spatial.mat'])]
+    elif format == 'npy':
+        return [os.path.join(store_path(output, format), 'metadata.json')]
+    else:
+        return [store_path(output, format)]
+
+
+def store_path(output, format):
+
+    """
+    Path of the npy store directory or hdf5 file of a subject.
+    """
+
+    if format == 'hdf5':
+        return '.'.join([output, 'h5'])
+    return output
+
+
+def fit_subject(rest_file, output, components, mask, Regressor, format='mat'):
+
+    rest = load(rest_file)
+
+    # chunked regressions read memory-mapped subjects a block of vertices at a time
+    if Regressor.chunk_size is not None:
+        if mask is not None:
+            rest = mask.view(rest)
+    else:
+        if mask is not None:
+            rest = mask.apply(rest)
+        rest = as_array(rest)
+
     # fit spatial and temporal regression components
     Regressor.fit(rest, components)
-    
+
+    with Regressor.fit_stats_.stage('write', rest_file):
+        save_subject(rest_file, output, mask, Regressor, format)
+
+
+def save_subject(rest_file, output, mask, Regressor, format='mat'):
+
+    if format != 'mat':
+        metadata = {'rest': rest_file,
+                    'standardize': Regressor.standardize,
+                    'hdr_alpha': Regressor.hdr_alpha,
+                    'tr': Regressor.tr,
+                    's_filter': Regressor.s_filter}
+        save_results(store_path(output, format),
+                     {'temporal': Regressor.temporal_, 'spatial': Regressor.spatial_},
+                     mask=mask, metadata=metadata, format=format)
+        return
+
     temporal = {'temporal': Regressor.temporal_}
     spatial = {'spatial': Regressor.spatial_}
 
-    if args.mask:
-        temp = np.zeros((mask.shape[0], spatial['spatial'].shape[1]))
-        temp[np.where(mask),:] = spatial['spatial']
-        spatial['spatial'] = temp
-    
-    sio.savemat(file_name='.'.join([args.output, 'Temporal.mat']), mdict=temporal)
-    sio.savemat(file_name='.'.join([args.output, 'Spatial.mat']), mdict=spatial)
-    
+    if mask is not None:
+        spatial['spatial'] = mask.scatter(spatial['spatial'])
 
-if __name__ == "__main__":
+    sio.savemat(file_name='.'.join([output, 'Temporal.mat']), mdict=temporal)
+    sio.savemat(file_name='.'.join([output, 'Spatial.mat']), mdict=spatial)
+
+
+def _init_worker(components, mask, args):
+
+    _shared['components'] = components
+    _shared['mask'] = mask
+    _shared['regressor'] = build_regressor(args)
+    _shared['format'] = args.format
+
+
+def _fit_shared(rest_file, output):
+
+    fit_subject(rest_file, output, _shared['components'], _shared['mask'], _shared['regressor'],
+                _shared['format'])
+
+
+def batch_subjects(args):
+
+    """
+    List (rest file, output base) pairs of subjects still to process.
+    """
+
+    if args.rest_list:
+        with open(args.rest_list, 'r') as f:
+            rest_files = f.read().split()
+    else:
+        rest_files = sorted(glob.glob(args.rest_glob))
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
 
+    subjects = []
+    for rest_file, name in zip(rest_files, output_names(rest_files)):
+        output = os.path.join(args.output, name)
+
+        if all(os.path.isfile(f) for f in output_files(output, args.format)):
+            logging.info('Skipping %s, outputs exist.', name)
+        else:
+            subjects.append((rest_file, output))
+
+    return subjects
+
+
+def output_names(rest_files):
+
+    """
+    Output base names of subjects, built from the paths of their rest files
+    relative to the common directory of all rest files, so that subjects
+    whose files share a basename (e.g. HCP-style trees) get distinct outputs.
+    """
+
+    if not rest_files:
+        return []
+
+    rest_files = [os.path.abspath(f) for f in rest_files]
+    root = os.path.commonpath([os.path.dirname(f) for f in rest_files])
+
+    names = []
+    for rest_file in rest_files:
+        directory, base = os.path.split(os.path.relpath(rest_file, root))
+        names.append(os.path.join(directory, base.split('.')[0]).replace(os.sep, '_'))
+
+    duplicates = sorted(name for name, count in Counter(names).items() if count > 1)
+    if duplicates:
+        raise ValueError('Rest files map to duplicate output names: %s.' % ', '.join(duplicates))
+
+    return names
+
+
+def main(args):
+
+    # load group components and mask once for all subjects
+    components, mask = load_components(args)
+
+    if args.rest:
+        fit_subject(args.rest, args.output, components, mask, build_regressor(args),
+                    args.format)
+        return
+
+    subjects = batch_subjects(args)
+    logging.info('Processing %i subjects.', len(subjects))
+    blas_threads = blas_threads_per_worker(args.n_jobs)
+
+    # keep at most two subjects per worker in flight, so memory stays bounded
+    with ProcessPoolExecutor(max_workers=args.n_jobs, initializer=_init_worker,
+                             initargs=(components, mask, args)) as pool:
+
+        pending = deque()
+        for rest_file, output in subjects:
+            pending.append((rest_file, pool.submit(call_with_blas_limit, blas_threads,
+                                                   _fit_shared, rest_file, output)))
+
+            if len(pending) >= 2*args.n_jobs:
+                rest_file, future = pending.popleft()
+                future.result()
+                logging.info('Finished %s', rest_file)
+
+        while pending:
+            rest_file, future = pending.popleft()
+            future.result()
+            logging.info('Finished %s', rest_file)
+
+
+if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Compute single-subject group-ICA maps using dual regression.')
 
-    parser.add_argument('-r', 
-                        '--rest', 
-                        help='Resting state file for subject.',
+    subjects = parser.add_mutually_exclusive_group(required=True)
+
+    subjects.add_argument('-r',
+                          '--rest',
+                          help='Resting state file for subject.',
+                          type=str)
+
+    subjects.add_argument('-rl',
+                          '--rest-list',
+                          help='File listing resting state files of many subjects (batch mode).',
+                          type=str)
+
+    subjects.add_argument('-rg',
+                          '--rest-glob',
+                          help='Glob pattern matching resting state files of many subjects (batch mode).',
+                          type=str)
+
+    parser.add_argument('-c',
+                        '--components',
+                        help='Group ICA components.',
                         required=True,
                         type=str)
 
-    parser.add_argument('-c', 
-                        '--components', 
-                        help='Group ICA components.', 
-                        required=True, 
-                        type=str)
-    
-    parser.add_argument('-m', 
-                        '--mask', 
-                        help='Inclusion mask.', 
-                        required=False, 
-                        default=None, 
+    parser.add_argument('-m',
+                        '--mask',
+                        help='Inclusion mask.',
+                        required=False,
+                        default=None,
                         type=str)
 
-    parser.add_argument('-o', 
-                        '--output', 
-                        help='Output base name for spatial and temporal components.', 
-                        required=True, 
+    parser.add_argument('-o',
+                        '--output',
+                        help='Output base name for spatial and temporal components, '
+                             'or output directory in batch mode.',
+                        required=True,
                         type=str)
 
-    parser.add_argument('-a', 
-                        '--alpha', 
-                        help='Bayesian confidence interval alpha value.', 
-                        required=False, 
-                        type=float, 
+    parser.add_argument('-a',
+                        '--alpha',
+                        help='Bayesian confidence interval alpha value.',
+                        required=False,
+                        type=float,
                         default=None)
-    
-    parser.add_argument('-tr', 
-                        '--rep-time', 
-                        help='Repetition time of rs-fmri bold signal.', 
-                        required=False, 
-                        type=float, 
+
+    parser.add_argument('-tr',
+                        '--rep-time',
+                        help='Repetition time of rs-fmri bold signal.',
+                        required=False,
+                        type=float,
                         default=0.720)
-    
+
     parser.add_argument('--standardize',
                         help='Temporal standardization of features.',
                         action='store_true',
                         required=False)
-    
+
     parser.add_argument('--filter',
                         help='Apply spectral filtering.',
                         action='store_true',
                         required=False)
 
+    parser.add_argument('--chunk-size',
+                        help='Number of vertices regressed at a time.',
+                        required=False,
+                        type=int,
+                        default=None)
+
+    parser.add_argument('--format',
+                        help='Output format.  npy and hdf5 stores hold the masked temporal '
+                             'and spatial maps, mask index and regression parameters.',
+                        required=False,
+                        type=str,
+                        choices=['mat', 'npy', 'hdf5'],
+                        default='mat')
+
+    parser.add_argument('--stats-log',
+                        help='JSON lines file of the time and memory of each stage.',
+                        required=False,
+                        type=str,
+                        default=None)
+
+    parser.add_argument('-j',
+                        '--n-jobs',
+                        help='Number of subjects processed in parallel in batch mode.',
+                        required=False,
+                        type=int,
+                        default=1)
+
     args = parser.parse_args()
 
-    main(args)
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    main(args)
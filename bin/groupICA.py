@@ -1,7 +1,10 @@
 import argparse
+import logging
 import os
 
 from meshica import canica as cICA
+from meshica.masking import VertexMask
+from meshica.results import save_results
 from niio import write
 
 parser = argparse.ArgumentParser()
@@ -20,11 +23,26 @@ parser.add_argument('-e', '--extension', help='Resting state file extension.',
     required=True, type=str)
 parser.add_argument('-o', '--output', help='Output file name for group ICA components.',
     required=True, type=str)
+parser.add_argument('-j', '--n_jobs', help='Number of FastICA restarts to run in parallel.',
+    required=False, type=int, default=4)
+parser.add_argument('-w', '--workers', help='Number of subjects loaded and cleaned in parallel.',
+    required=False, type=int, default=1)
+parser.add_argument('--backend', help='Joblib parallel backend for FastICA restarts.',
+    required=False, type=str, default=None)
+parser.add_argument('--blas_threads', help='BLAS threads per parallel worker.',
+    required=False, type=int, default=None)
+parser.add_argument('--format', help='Output format.  npy and hdf5 stores hold the masked '
+    'components, mask index and fit parameters.',
+    required=False, type=str, choices=['cifti', 'npy', 'hdf5'], default='cifti')
+parser.add_argument('--stats_log', help='JSON lines file of the time and memory of each stage.',
+    required=False, type=str, default=None)
 parser.add_argument('-hemi', '--hemisphere', help='Hemisphere to process.',
     required=False, type=str, choices=['L','R'], default='L')
 
 args = parser.parse_args()
 
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
 with open(args.subject_list,'r') as inFile:
     subjects = inFile.readlines()
 subjects = [x.strip() for x in subjects]
@@ -42,11 +60,25 @@ for s in subjects:
         resting.append(temp_file)
 
 print('Fitting gICA components...')
-ica = cICA.CanICA(n_components=args.n_components, low_pass=args.low_pass, t_r=args.rep_time)
+ica = cICA.CanICA(n_components=args.n_components, low_pass=args.low_pass, t_r=args.rep_time,
+    n_jobs=args.n_jobs, backend=args.backend, blas_threads=args.blas_threads,
+    stats_log=args.stats_log, n_workers=args.workers)
 ica.fit(resting)
 
 hemimap = {'L': 'CortexLeft',
             'R': 'CortexRight'}
 
 print('Saving gICA components...')
-write.save(ica.components_, args.output, hemimap[args.hemisphere])
+with ica.fit_stats_.stage('write'):
+    if args.format == 'cifti':
+        write.save(ica.components_, args.output, hemimap[args.hemisphere])
+    else:
+        # CanICA masks out vertices that are all-zero in any subject
+        mask = VertexMask(~ica.mask)
+        metadata = {'n_components': args.n_components,
+                    'low_pass': args.low_pass,
+                    't_r': args.rep_time,
+                    'hemisphere': hemimap[args.hemisphere],
+                    'files': resting}
+        save_results(args.output, {'components': mask.apply(ica.components_)}, mask=mask,
+            metadata=metadata, format=args.format)
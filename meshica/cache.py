@@ -0,0 +1,243 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .cleaning import CLEANING_VERSION
+
+
+class SubjectCache(object):
+
+    def __init__(self, location, max_bytes=None):
+
+        """
+        On-disk cache of cleaned single-subject matrices.
+
+        Entries are keyed by a hash of the subject's content and the
+        parameters used to clean it, so re-fitting with a different number
+        of components or threshold reuses the cleaned data.  Keys also
+        include the version of the cleaning kernel.  Floating point
+        entries are stored as float32 .npy files, unless another
+        precision is requested, and returned as read-only memory maps.
+        When ``max_bytes`` is exceeded, the least recently used entries
+        are evicted.
+
+        Parameters:
+        - - - - -
+        location: str
+            directory in which cache entries are stored
+        max_bytes: int
+            maximum total size of the cache, in bytes
+            default: None (unbounded)
+        """
+
+        self.location = location
+        self.max_bytes = max_bytes
+
+        self._hashes = {}
+
+        if not os.path.isdir(location):
+            os.makedirs(location)
+
+    def key(self, source, **params):
+
+        """
+        Compute the cache key of a subject.
+
+        Parameters:
+        - - - - -
+        source: str, or float array
+            subject file, or in-memory subject matrix
+        params: keyword arguments
+            parameters that affect the cached result
+            arrays (e.g. masks) are hashed by content
+
+        Returns:
+        - - - -
+        key: str
+            hexadecimal cache key
+        """
+
+        digest = hashlib.sha1()
+        digest.update(self._content_hash(source).encode())
+        digest.update(json.dumps(['cleaning_version', CLEANING_VERSION]).encode())
+
+        for name in sorted(params):
+            value = params[name]
+            if isinstance(value, np.ndarray):
+                value = _array_hash(value)
+            digest.update(json.dumps([name, value], default=str).encode())
+
+        return digest.hexdigest()
+
+    def get(self, key):
+
+        """
+        Retrieve a cache entry.
+
+        Parameters:
+        - - - - -
+        key: str
+            cache key
+
+        Returns:
+        - - - -
+        array: numpy.memmap
+            read-only memory map of the entry, or None if absent
+        """
+
+        entry = self._entry(key)
+
+        try:
+            array = np.load(entry, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+
+        # mark entry as recently used
+        os.utime(entry, None)
+
+        return array
+
+    def put(self, key, array, dtype=np.float32):
+
+        """
+        Store a cache entry.
+
+        Parameters:
+        - - - - -
+        key: str
+            cache key
+        array: array
+            entry to store
+        dtype: numpy dtype
+            precision floating point arrays are stored in
+            include it in the key if it can vary between fits
+
+        Returns:
+        - - - -
+        array: numpy.memmap
+            read-only memory map of the stored entry, or the array itself
+            if the entry alone exceeds the cache budget
+        """
+
+        array = np.asarray(array)
+        if np.issubdtype(array.dtype, np.floating):
+            array = array.astype(dtype, copy=False)
+
+        entry = self._entry(key)
+        temp_entry = '%s.%i.tmp' % (entry, os.getpid())
+
+        with open(temp_entry, 'wb') as f:
+            np.save(f, array)
+        os.replace(temp_entry, entry)
+
+        self._evict()
+
+        cached = self.get(key)
+        if cached is None:
+            return array
+        return cached
+
+    def clear(self):
+
+        """
+        Remove all cache entries.
+        """
+
+        for entry in self._entries():
+            _remove(entry)
+
+    def _entry(self, key):
+
+        return os.path.join(self.location, key + '.npy')
+
+    def _entries(self):
+
+        return [os.path.join(self.location, f) for f in os.listdir(self.location)
+                if f.endswith('.npy')]
+
+    def _evict(self):
+
+        """
+        Remove least recently used entries until the cache fits its budget.
+        """
+
+        if self.max_bytes is None:
+            return
+
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = os.stat(entry)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(entry)
+            total -= size
+
+    def _content_hash(self, source):
+
+        """
+        Hash a subject file or matrix by content.
+
+        File hashes are memoized on (path, size, modification time), so
+        each file is read at most once per cache instance.
+        """
+
+        if isinstance(source, np.ndarray):
+            return _array_hash(source)
+
+        stat = os.stat(source)
+        signature = (os.path.abspath(source), stat.st_size, stat.st_mtime_ns)
+
+        if signature not in self._hashes:
+            digest = hashlib.sha1()
+            with open(source, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 24), b''):
+                    digest.update(block)
+            self._hashes[signature] = digest.hexdigest()
+
+        return self._hashes[signature]
+
+
+def as_cache(cache):
+
+    """
+    Convert an estimator's ``cache`` argument to a SubjectCache.
+
+    Parameters:
+    - - - - -
+    cache: None, str, or SubjectCache
+        no cache, cache directory, or existing cache
+
+    Returns:
+    - - - -
+    cache: SubjectCache, or None
+    """
+
+    if cache is None or isinstance(cache, SubjectCache):
+        return cache
+    return SubjectCache(cache)
+
+
+def _array_hash(array):
+
+    digest = hashlib.sha1()
+    digest.update(str((array.shape, array.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(array).data)
+
+    return digest.hexdigest()
+
+
+def _remove(entry):
+
+    try:
+        os.remove(entry)
+    except OSError:
+        pass
@@ -1,23 +1,34 @@
-from niio import loaded, write
-from operator import itemgetter
+from niio import write
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import shutil
+import tempfile
 
 import numpy as np
-from nilearn.signal import clean
-from nilearn.decomposition.base import fast_svd
 
 from scipy.stats import scoreatpercentile
-from sklearn.decomposition import fastica
-from sklearn.utils import check_random_state
-from sklearn.utils.extmath import randomized_svd
 
-import joblib
-from joblib import Memory, delayed, Parallel
+from .cache import as_cache
+from .cleaning import clean_signals
+from .instrumentation import FitStats
+from .loading import as_array, load
+from .masking import VertexMask
+from .parallel import blas_threads_per_worker, call_with_blas_limit
+from .svd import blocked_randomized_svd, truncated_svd
+from .unmixing import fastica_restarts
+from .validation import as_quarantine, screen
+
+logger = logging.getLogger(__name__)
 
 class CanICA(object):
     
     def __init__(self, n_components=20, pca_filter=False, n_init=10,
                  do_cca=False, standardize=True, low_pass=None, high_pass=None, t_r=None,
-                 threshold='auto', random_state=None):
+                 threshold='auto', random_state=None, cache=None, streaming=False,
+                 memmap=None, svd_block_size=None, n_jobs=4, backend=None,
+                 blas_threads=None, dtype=np.float64, quarantine=None,
+                 stats_log=None, svd_solver='auto', n_workers=1):
 
         """
 
@@ -36,6 +47,35 @@ class CanICA(object):
         :param low_pass: low-pass filter limit
         :param high_pass: high-pass filter limit
         :param tr: repetitiion time
+        :param cache: directory or SubjectCache in which to store cleaned
+                      subject matrices for reuse across fits
+        :param streaming: concatenate subjects in two passes directly into a
+                          preallocated array, so that peak memory is about one
+                          copy of the group data
+        :param memmap: file in which to store the preallocated array as a
+                       memory-mapped .npy file when streaming
+        :param svd_block_size: if set, compute the group PCA with a blocked
+                               randomized SVD that reads this many rows of
+                               the group matrix at a time, so that it can stay
+                               memory-mapped on disk
+        :param n_jobs: number of FastICA restarts run in parallel
+        :param backend: joblib parallel backend used for the restarts
+        :param blas_threads: BLAS threads per restart; by default the
+                             available cores are divided between restarts
+        :param dtype: floating point precision used for loading, cleaning,
+                      concatenation, SVD and FastICA; np.float32 halves
+                      memory use and is recommended for large cohorts
+        :param quarantine: JSON manifest or Quarantine of excluded subjects
+        :param stats_log: JSON lines file to which the time and memory of
+                          each stage are appended; stage records are also
+                          kept in the ``fit_stats_`` attribute
+        :param svd_solver: solver of the subject and group PCA: 'gram'
+                           (eigendecomposition of the smaller Gram matrix),
+                           'randomized', 'full', or 'auto' to pick the
+                           cheapest for the matrix shape and rank
+        :param n_workers: number of processes that load, clean and reduce
+                          subjects in parallel; prepared subjects are passed
+                          back as memory-mapped .npy files
         """
 
         self.n_components = n_components
@@ -50,6 +90,18 @@ class CanICA(object):
 
         self.threshold=threshold
         self.random_state=random_state
+        self.cache = cache
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.blas_threads = blas_threads
+        self.dtype = dtype
+        self.quarantine = quarantine
+        self.stats_log = stats_log
+        self.svd_solver = svd_solver
+        self.n_workers = n_workers
+        self.streaming = streaming
+        self.memmap = memmap
+        self.svd_block_size = svd_block_size
 
     def fit(self,input_files):
 
@@ -59,6 +111,8 @@ class CanICA(object):
         :param input_files: list of input resting state matrices
         """
 
+        self.fit_stats_ = FitStats(self.stats_log)
+
         signals = self._merge_and_reduce(input_files)
         self._raw_fit(signals)
         self._unmix_components()
@@ -70,20 +124,13 @@ class CanICA(object):
         Core function of CanICA to rotate components to maximize independance
         """
 
-        print('Unmixing components')
-
-        random_state = check_random_state(self.random_state)
-
-        seeds = random_state.randint(np.iinfo(np.int32).max, size=self.n_init)
-        results = Parallel(n_jobs=4)(
-            delayed(fastica)(self.components_.T,whiten=True,
-                             fun='cube',random_state=seed) for seed in seeds)
+        logger.info('Unmixing components')
 
-        ica_maps_gen_ = (result[2].T for result in results)
-        ica_maps_and_sparsities = ((ica_map,
-                                    np.sum(np.abs(ica_map), axis=1).max())
-                                   for ica_map in ica_maps_gen_)
-        ica_maps, _ = min(ica_maps_and_sparsities, key=itemgetter(-1))
+        ica_maps = fastica_restarts(self.components_.T, n_init=self.n_init,
+                                    random_state=self.random_state,
+                                    n_jobs=self.n_jobs, backend=self.backend,
+                                    blas_threads=self.blas_threads, dtype=self.dtype,
+                                    stats=self.fit_stats_)
 
         # Thresholding
         ratio = None
@@ -97,11 +144,12 @@ class CanICA(object):
                              str(self.threshold))
 
         if ratio is not None:
-            abs_ica_maps = abs(ica_maps)
-            threshold = scoreatpercentile(
-                abs_ica_maps,
-                100. - (100. / len(ica_maps)) * ratio)
-            ica_maps[abs_ica_maps < threshold] = 0.
+            with self.fit_stats_.stage('threshold'):
+                abs_ica_maps = abs(ica_maps)
+                threshold = scoreatpercentile(
+                    abs_ica_maps,
+                    100. - (100. / len(ica_maps)) * ratio)
+                ica_maps[abs_ica_maps < threshold] = 0.
         self.components_ = ica_maps
 
         # flip signs in each component so that peak is +ve
@@ -122,46 +170,364 @@ class CanICA(object):
         :return signals: concatenated resting state arrays
         """
 
-        signals = []
+        quarantine = as_quarantine(self.quarantine)
+        input_files = self._exclude_quarantined(input_files, quarantine)
 
-        for inp in input_files:
+        if self.streaming:
+            return self._stream_merge_and_reduce(input_files, quarantine)
 
-            print('Loading {:}'.format(inp.split('/')[-1]))
+        signals = []
+        cache = as_cache(self.cache)
+        directory = self._scratch_directory()
 
-            matrix = loaded.load(inp)
+        try:
+            for inp, matrix, zeros in self._prepare_subjects(input_files, cache,
+                                                             quarantine, directory):
 
-            try:
-                z
-            except NameError:
-                z = np.zeros((matrix.shape[0],))
-            else:
-                pass
-            finally:
-                zinds = np.where(np.abs(matrix).sum(1) == 0)[0]
-                if len(zinds) > 3000:
-                    pass
+                try:
+                    z
+                except NameError:
+                    z = np.zeros((zeros.shape[0],))
                 else:
-                    z[zinds] += 1
+                    pass
+                finally:
+                    if matrix is None:
+                        pass
+                    else:
+                        z[zeros] += 1
+                        signals.append(matrix)
+
+            if quarantine is not None:
+                quarantine.save()
+
+            self.mask = z.astype(bool)
+            self._vertex_mask = VertexMask(~self.mask)
+            logger.info('Excluding %i all-zero vertices.', self.mask.sum())
+            logger.info('Concatenating %i subjects.', len(signals))
+            with self.fit_stats_.stage('concatenate'):
+                signals = np.column_stack(signals).astype(self.dtype, copy=False)
+                signals = self._vertex_mask.apply(signals)
+        finally:
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
+        
+        logger.debug('Group matrix shape: %s', signals.shape)
+
+        return signals.T
+
+    def _prepare_subjects(self, input_files, cache=None, quarantine=None, directory=None):
+
+        """
+
+        Load, clean and optionally temporally reduce each subject, in the
+        order of the input files.  With n_workers > 1, subjects are
+        prepared in parallel worker processes, which write their results
+        to .npy files in ``directory``; they are returned as memory maps.
+
+        :param input_files: list of input resting state matrix files
+        :param cache: SubjectCache of previously cleaned subjects
+        :param quarantine: Quarantine to record rejected subjects in
+        :param directory: scratch directory of worker results
+        :return: generator of (file, matrix, zeros), where matrix is None
+                 if the subject is rejected by screening
+        """
+
+        if self.n_workers <= 1:
+            for inp in input_files:
 
-                    matrix = clean(matrix,standardize=self.standardize,
-                                low_pass=self.low_pass,high_pass=self.high_pass,
-                                t_r=self.t_r)
+                logger.info('Loading %s', inp.split('/')[-1])
 
-                    if self.pca_filter:
+                matrix, zeros = self._load_subject(inp, cache, quarantine)
+
+                if matrix is not None and self.pca_filter:
+                    with self.fit_stats_.stage('reduce', inp):
                         matrix = self._reduce(matrix)
 
-                    signals.append(matrix)
+                yield inp, matrix, zeros
+            return
 
-        self.mask = z.astype(np.bool)
-        print(self.mask.sum())
-        print(len(signals))
-        signals = np.column_stack(signals)
-        signals = signals[~self.mask, :]
-        
-        print(signals.shape)
+        params = self._worker_params()
+        manifest = None if quarantine is None else quarantine.manifest
+        blas_threads = blas_threads_per_worker(self.n_workers, self.blas_threads)
+        outputs = [os.path.join(directory, 'subject_%i.npy' % (i)) for i in range(len(input_files))]
 
-        return signals.T
+        logger.info('Preparing %i subjects with %i workers.', len(input_files), self.n_workers)
+
+        with ProcessPoolExecutor(max_workers=self.n_workers) as executor:
+            futures = [executor.submit(call_with_blas_limit, blas_threads, _prepare_subject,
+                                       params, inp, output, manifest)
+                       for inp, output in zip(input_files, outputs)]
+
+            for inp, future in zip(input_files, futures):
+
+                output, zeros, quarantined, records = future.result()
+                self.fit_stats_.extend(records)
+                if quarantine is not None:
+                    quarantine.subjects.update(quarantined)
+
+                matrix = None
+                if output is not None:
+                    matrix = np.load(output, mmap_mode='r')
+
+                yield inp, matrix, zeros
+
+    def _scratch_directory(self):
 
+        """
+
+        Create a scratch directory for the results of parallel workers,
+        next to the ``memmap`` file if one is given.
+
+        :return directory: scratch directory, or None if n_workers <= 1
+        """
+
+        if self.n_workers <= 1:
+            return None
+
+        parent = None
+        if self.memmap is not None:
+            parent = os.path.dirname(os.path.abspath(self.memmap))
+
+        return tempfile.mkdtemp(prefix='canica-', dir=parent)
+
+    def _worker_params(self):
+
+        """
+
+        Parameters used to construct CanICA instances in worker processes.
+
+        :return: dictionary of constructor arguments
+        """
+
+        return {'n_components': self.n_components,
+                'pca_filter': self.pca_filter,
+                'standardize': self.standardize,
+                'low_pass': self.low_pass,
+                'high_pass': self.high_pass,
+                't_r': self.t_r,
+                'cache': self.cache,
+                'dtype': self.dtype,
+                'svd_solver': self.svd_solver}
+
+    def _exclude_quarantined(self, input_files, quarantine=None):
+
+        """
+
+        Remove previously quarantined subjects from the input files.
+
+        :param input_files: list of input resting state matrix files
+        :param quarantine: Quarantine of previously rejected subjects
+        :return input_files: list of files not in quarantine
+        """
+
+        if quarantine is None:
+            return input_files
+
+        included = [inp for inp in input_files if inp not in quarantine]
+        logger.info('Excluding %i quarantined subjects.', len(input_files) - len(included))
+
+        return included
+
+    def _stream_merge_and_reduce(self, input_files, quarantine=None):
+
+        """
+
+        Clean, temporally reduce, and concatenate resting state matrix files
+        in two passes.  The first pass computes the vertex mask and output
+        size, and the second writes each cleaned subject directly into a
+        preallocated, masked (time x vertices) output array.
+
+        :param input_files: list of input resting state matrix files
+        :param quarantine: Quarantine to record rejected subjects in
+        :return signals: concatenated resting state arrays
+        """
+
+        cache = as_cache(self.cache)
+
+        z = None
+        widths = []
+        for inp in input_files:
+
+            logger.info('Scanning %s', inp.split('/')[-1])
+
+            zeros, width = self._scan_subject(inp, cache, quarantine)
+
+            if z is None:
+                z = np.zeros((zeros.shape[0],))
+            if width > 0:
+                z[zeros] += 1
+            widths.append(width)
+
+        if quarantine is not None:
+            quarantine.save()
+
+        self.mask = z.astype(bool)
+        self._vertex_mask = VertexMask(~self.mask)
+        shape = (sum(widths), self._vertex_mask.n_kept)
+
+        logger.info('Excluding %i all-zero vertices.', self.mask.sum())
+        logger.info('Concatenating %i subjects.', np.count_nonzero(widths))
+
+        if self.memmap is not None:
+            signals = np.lib.format.open_memmap(self.memmap, mode='w+',
+                                                dtype=self.dtype, shape=shape)
+        else:
+            signals = np.empty(shape, dtype=self.dtype)
+
+        accepted = [inp for inp, width in zip(input_files, widths) if width > 0]
+        widths = [width for width in widths if width > 0]
+        directory = self._scratch_directory()
+
+        offset = 0
+        try:
+            subjects = self._prepare_subjects(accepted, cache, directory=directory)
+            for (inp, matrix, _), width in zip(subjects, widths):
+
+                if matrix.shape[1] != width:
+                    raise ValueError('Subject %s has %i columns, expected %i.' %
+                                     (inp, matrix.shape[1], width))
+
+                with self.fit_stats_.stage('concatenate', inp):
+                    signals[offset:offset+width, :] = self._vertex_mask.apply(matrix).T
+                offset += width
+        finally:
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        logger.debug('Group matrix shape: %s', signals.shape)
+
+        return signals
+
+    def _scan_subject(self, inp, cache=None, quarantine=None):
+
+        """
+
+        Compute the all-zero vertices and number of output columns of a
+        single resting state matrix file, without keeping its data.
+
+        :param inp: resting state matrix file
+        :param cache: SubjectCache of previously cleaned subjects
+        :param quarantine: Quarantine to record rejected subjects in
+        :return zeros: boolean array of all-zero vertices
+        :return width: number of columns the subject contributes, or 0 if
+                       the subject is rejected by screening
+        """
+
+        if cache is not None:
+            # populates the cache, so the second pass reads memory maps
+            matrix, zeros = self._load_subject(inp, cache, quarantine)
+        else:
+            # screening reads the memory-mapped subject one block at a time
+            with self.fit_stats_.stage('load', inp):
+                matrix = load(inp)
+                zeros, accepted = self._screen_subject(inp, matrix, quarantine)
+            if not accepted:
+                matrix = None
+
+        if matrix is None:
+            return zeros, 0
+        elif self.pca_filter:
+            return zeros, self.n_components
+        else:
+            return zeros, matrix.shape[1]
+
+    def _screen_subject(self, inp, matrix, quarantine=None):
+
+        """
+
+        Screen a loaded resting state matrix for non-finite values and
+        all-zero vertices in a single pass.
+
+        :param inp: resting state matrix file
+        :param matrix: resting state matrix
+        :param quarantine: Quarantine to record rejected subjects in
+        :return zeros: boolean array of all-zero vertices
+        :return accepted: whether the subject passed screening
+        """
+
+        report, zeros = screen(matrix)
+
+        return zeros, self._check_report(inp, report, quarantine)
+
+    def _check_report(self, inp, report, quarantine=None):
+
+        """
+
+        Accept or reject a subject from its screening report, and
+        quarantine rejected subjects.
+
+        :param inp: resting state matrix file
+        :param report: screening report, as returned by ``screen``
+                       cached subjects only report 'zero_rows'
+        :param quarantine: Quarantine to record rejected subjects in
+        :return accepted: whether the subject passed screening
+        """
+
+        reason = None
+        if report.get('nans', 0) > 0 or report.get('infs', 0) > 0:
+            reason = 'non-finite values'
+        elif report['zero_rows'] > 3000:
+            reason = 'too many all-zero vertices'
+
+        if reason is not None:
+            logger.warning('Rejecting %s: %s', inp.split('/')[-1], reason)
+            if quarantine is not None:
+                quarantine.add(inp, report, reason)
+
+        return reason is None
+
+    def _load_subject(self, inp, cache=None, quarantine=None):
+
+        """
+
+        Load and clean a single resting state matrix file.
+
+        :param inp: resting state matrix file
+        :param cache: SubjectCache of previously cleaned subjects
+        :param quarantine: Quarantine to record rejected subjects in
+        :return matrix: cleaned resting state matrix, or None if the
+                        subject is rejected by screening
+        :return zeros: boolean array of all-zero vertices
+        """
+
+        stats = self.fit_stats_
+
+        if cache is not None:
+            key = cache.key(inp, standardize=self.standardize,
+                            low_pass=self.low_pass, high_pass=self.high_pass,
+                            t_r=self.t_r, dtype=np.dtype(self.dtype).str)
+            zeros_key = cache.key(inp, zeros=True)
+
+            with stats.stage('load', inp):
+                zeros = cache.get(zeros_key)
+                matrix = None
+                if zeros is not None and zeros.sum() <= 3000:
+                    matrix = cache.get(key)
+            if zeros is not None:
+                if not self._check_report(inp, {'zero_rows': int(zeros.sum())}, quarantine):
+                    return None, zeros
+                if matrix is not None:
+                    return matrix, zeros
+
+        # rejected subjects are screened without being read into memory
+        with stats.stage('load', inp):
+            matrix = load(inp)
+            zeros, accepted = self._screen_subject(inp, matrix, quarantine)
+
+        if not accepted:
+            matrix = None
+        else:
+            with stats.stage('clean', inp):
+                matrix = clean_signals(as_array(matrix, self.dtype),standardize=self.standardize,
+                                       low_pass=self.low_pass,high_pass=self.high_pass,
+                                       t_r=self.t_r)
+
+        if cache is not None:
+            zeros = cache.put(zeros_key, zeros)
+            if matrix is not None:
+                matrix = cache.put(key, matrix, dtype=self.dtype)
+
+        return matrix, zeros
 
     def _raw_fit(self, data):
 
@@ -171,33 +537,74 @@ class CanICA(object):
         :param data: raw resting state signals
         """
 
-        print('Fitting with CCA = {:}'.format(str(self.do_cca)))
+        logger.info('Fitting with CCA = %s', self.do_cca)
 
         if self.do_cca:
             S = np.sqrt(np.sum(data ** 2, axis=1))
             S[S == 0] = 1
             data /= S[:, np.newaxis]
 
-        self.components_, self.variance_, _ = randomized_svd(data.T, n_components=self.n_components,
-            transpose=True, random_state=None, n_iter=3)
+        with self.fit_stats_.stage('svd'):
+            if self.svd_block_size is not None:
+                _, self.variance_, components = blocked_randomized_svd(data, self.n_components,
+                    n_iter=3, block_size=self.svd_block_size, random_state=None, dtype=self.dtype)
+                self.components_ = components.T
+            else:
+                self.components_, self.variance_, _ = truncated_svd(data.T, self.n_components,
+                    solver=self.svd_solver, n_iter=3)
 
         if self.do_cca:
             data *= S[:, np.newaxis]
 
-        components = np.zeros((self.n_components, self.mask.shape[0]))
-        components[:, ~self.mask] = self.components_.T
-        self.components_ = components
+        self.components_ = VertexMask(~self.mask).scatter(self.components_).T
 
     def _reduce(self,signals):
 
         """
         Perform temporal dimensionality reduction.
 
-        :param signals: single-subject resting state matrix.
-        :return U: reduced resting state matrix
+        :param signals: single-subject (vertices x time) resting state matrix.
+        :return U: reduced (vertices x n_components) resting state matrix
         """
 
-        U, S, V = fast_svd(signals.T, self.n_components)
-        U = U.T.copy()
-        U = U * S[:, np.newaxis]
-        return U
\ No newline at end of file
+        U, S, _ = truncated_svd(signals, self.n_components, solver=self.svd_solver)
+        U = U * S[np.newaxis, :]
+        return U
+
+
+def _prepare_subject(params, inp, output, manifest=None):
+
+    """
+
+    Load, clean and optionally temporally reduce a single subject in a
+    worker process, and write the result to a .npy file.
+
+    :param params: CanICA constructor arguments
+    :param inp: resting state matrix file
+    :param output: .npy file to write the prepared matrix to
+    :param manifest: quarantine manifest
+    :return output: the .npy file, or None if the subject is rejected
+    :return zeros: boolean array of all-zero vertices
+    :return quarantined: quarantine entry of the subject, if rejected
+    :return records: stage records of the subject
+    """
+
+    model = CanICA(**params)
+    model.fit_stats_ = FitStats()
+    quarantine = as_quarantine(manifest)
+
+    matrix, zeros = model._load_subject(inp, as_cache(model.cache), quarantine)
+
+    quarantined = {}
+    if quarantine is not None and inp in quarantine:
+        quarantined[inp] = quarantine.subjects[inp]
+
+    if matrix is None:
+        output = None
+    else:
+        if model.pca_filter:
+            with model.fit_stats_.stage('reduce', inp):
+                matrix = model._reduce(matrix)
+        np.save(output, matrix)
+
+    return output, np.asarray(zeros), quarantined, model.fit_stats_.records
@@ -0,0 +1,276 @@
+from functools import lru_cache
+
+import numpy as np
+from scipy import signal as sp_signal
+
+EPS = np.finfo(np.float32).eps
+
+# working memory of one block of signals, including the filter padding
+BLOCK_BYTES = 2**24
+
+# version of the cleaning kernel, part of every subject cache key, so that
+# subjects cleaned by an earlier kernel (e.g. nilearn's clean) are not reused
+CLEANING_VERSION = 2
+
+
+def clean_signals(signals, standardize=True, detrend=True, low_pass=None,
+                  high_pass=None, t_r=None, order=5, chunk_size=None, copy=False,
+                  filter_method='sos', block_bytes=BLOCK_BYTES):
+
+    """
+    Detrend, band-pass filter and standardize signals in place.
+
+    Follows the semantics of ``nilearn.signal.clean`` without confounds:
+    linear detrending, a zero-phase Butterworth filter (``sosfiltfilt``
+    with odd padding), and z-scoring with the sample standard deviation.
+    Time is along the first axis, as in ``clean``.  All three steps are
+    applied to one block of columns at a time, in the caller's buffer and
+    precision, so that only block-sized temporaries are created.  Blocks
+    are sized so that a padded block, in double precision, fits in
+    ``block_bytes``; long signals are therefore cleaned a few columns at
+    a time.
+
+    Parameters:
+    - - - - -
+    signals: float, array
+        signals, shape (n_timepoints, n_signals)
+    standardize: bool
+        z-score each signal
+    detrend: bool
+        remove the linear trend of each signal
+    low_pass, high_pass: float
+        cutoff frequencies of the Butterworth filter, in Hz
+        default: None (no filtering)
+    t_r: float
+        repetition time, in seconds
+        required if filtering
+    order: int
+        order of the Butterworth filter
+    chunk_size: int
+        number of signals processed at a time
+        default: None (as many as fit in block_bytes)
+    copy: bool
+        clean a copy of the signals rather than the signals themselves
+        read-only and non-floating point inputs are always copied
+    filter_method: str
+        'sos': zero-phase filtering with second-order sections
+        'fft': multiplication by the precomputed zero-phase frequency
+        response, faster for long runs, approximate near the edges
+        see FilterPlan
+    block_bytes: int
+        memory budget of one padded block of signals, in bytes
+
+    Returns
+    - - - -
+    signals: float, array
+        cleaned signals, shape (n_timepoints, n_signals)
+    """
+
+    signals = np.asarray(signals)
+    if copy or not signals.flags.writeable or not np.issubdtype(signals.dtype, np.floating):
+        dtype = signals.dtype if np.issubdtype(signals.dtype, np.floating) else np.float64
+        signals = np.array(signals, dtype=dtype)
+
+    n_timepoints = signals.shape[0]
+    if n_timepoints == 1:
+        return signals
+
+    # filter plans are designed once per set of parameters, and reused
+    plan = filter_plan(low_pass, high_pass, t_r, n_timepoints, order, filter_method)
+
+    if chunk_size is None:
+        padded = n_timepoints if plan is None else n_timepoints + 2 * plan.padlen
+        chunk_size = max(1, block_bytes // (padded * np.dtype(np.float64).itemsize))
+
+    if detrend:
+        regressor = np.arange(n_timepoints, dtype=signals.dtype)
+        regressor -= regressor.mean()
+        regressor /= np.sqrt((regressor**2).sum())
+
+    for start in range(0, signals.shape[1], chunk_size):
+
+        block = signals[:, start:start+chunk_size]
+
+        if detrend:
+            block -= block.mean(axis=0)
+            block -= np.outer(regressor, np.dot(regressor, block))
+
+        if plan is not None:
+            block[...] = plan.apply(block)
+
+        if standardize:
+            block -= block.mean(axis=0)
+            std = block.std(axis=0, ddof=1)
+            std[std < np.finfo(np.float64).eps] = 1.
+            block /= std
+
+    return signals
+
+
+class FilterPlan(object):
+
+    def __init__(self, sos, n_timepoints, sampling_rate, method='sos'):
+
+        """
+        Precomputed zero-phase Butterworth filter for signals of a given
+        length.
+
+        'sos' plans reproduce ``scipy.signal.sosfiltfilt`` with odd padding,
+        with the initial conditions precomputed.  'fft' plans precompute the
+        squared magnitude response of the filter at the FFT frequencies of
+        the padded signal, so that filtering is a single multiplication in
+        the frequency domain.  The two agree closely for low-pass filters.
+        With a high-pass cutoff they differ within a few cutoff periods of
+        the edges, where the initial conditions of forward-backward
+        filtering (which 'fft' plans do not use) dominate.
+
+        Parameters:
+        - - - - -
+        sos: float, array
+            second-order sections of the filter
+        n_timepoints: int
+            length of the signals
+        sampling_rate: float
+            sampling rate, in Hz
+        method: str
+            'sos' or 'fft'
+        """
+
+        if method not in ['sos', 'fft']:
+            raise ValueError("method must be 'sos' or 'fft'. You provided %s." % str(method))
+
+        n_taps = 2 * sos.shape[0] + 1
+        n_taps -= min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+        padlen = 3 * n_taps
+
+        if n_timepoints <= padlen:
+            raise ValueError('Signals of %i timepoints are too short to be filtered, '
+                             'they must be longer than %i.' % (n_timepoints, padlen))
+
+        self.sos = sos
+        self.n_timepoints = n_timepoints
+        self.method = method
+        self.padlen = padlen
+
+        if method == 'sos':
+            self.zi = sp_signal.sosfilt_zi(sos)[:, :, np.newaxis]
+        else:
+            n_padded = n_timepoints + 2 * padlen
+            frequencies = np.fft.rfftfreq(n_padded, d=1. / sampling_rate)
+            _, response = sp_signal.sosfreqz(sos, worN=frequencies, fs=sampling_rate)
+            self.response = (np.abs(response)**2)[:, np.newaxis]
+
+    def apply(self, signals):
+
+        """
+        Filter signals along the first axis.
+
+        Parameters:
+        - - - - -
+        signals: float, array
+            signals, shape (n_timepoints, n_signals)
+
+        Returns:
+        - - - -
+        filtered: float, array
+            filtered signals, shape (n_timepoints, n_signals)
+        """
+
+        padlen = self.padlen
+
+        # odd extension of the signals at both ends
+        extended = np.concatenate([2*signals[:1] - signals[padlen:0:-1],
+                                   signals,
+                                   2*signals[-1:] - signals[-2:-(padlen+2):-1]])
+
+        if self.method == 'fft':
+            spectrum = np.fft.rfft(extended, axis=0)
+            spectrum *= self.response
+            filtered = np.fft.irfft(spectrum, n=extended.shape[0], axis=0)
+        else:
+            filtered, _ = sp_signal.sosfilt(self.sos, extended, axis=0,
+                                            zi=self.zi * extended[:1])
+            filtered, _ = sp_signal.sosfilt(self.sos, filtered[::-1], axis=0,
+                                            zi=self.zi * filtered[-1:])
+            filtered = filtered[::-1]
+
+        return filtered[padlen:-padlen]
+
+
+@lru_cache(maxsize=64)
+def filter_plan(low_pass=None, high_pass=None, t_r=None, n_timepoints=None, order=5,
+                method='sos'):
+
+    """
+    Build (or reuse) the filter plan of a set of filtering parameters.
+
+    Plans are cached on (low_pass, high_pass, t_r, n_timepoints, order,
+    method), so that the filter is designed once, however many subjects
+    and estimators are cleaned with the same parameters.
+
+    Returns:
+    - - - -
+    plan: FilterPlan
+        filter plan, or None if no filtering is requested
+    """
+
+    sos = butterworth_sos(low_pass, high_pass, t_r, order)
+    if sos is None:
+        return None
+
+    return FilterPlan(sos, n_timepoints, 1. / t_r, method)
+
+
+def butterworth_sos(low_pass=None, high_pass=None, t_r=None, order=5):
+
+    """
+    Design a Butterworth filter as second-order sections.
+
+    Cutoffs at or above the Nyquist frequency are lowered just below it,
+    as in ``nilearn.signal.butterworth``.
+
+    Returns:
+    - - - -
+    sos: float, array
+        second-order sections, or None if no filtering is requested
+    """
+
+    if low_pass is None and high_pass is None:
+        return None
+
+    if t_r is None:
+        raise ValueError('Repetition time (t_r) must be specified for filtering.')
+
+    if low_pass is not None and high_pass is not None and high_pass >= low_pass:
+        raise ValueError('High pass cutoff frequency (%s) is greater than or equal '
+                         'to low pass cutoff frequency (%s).' % (high_pass, low_pass))
+
+    sampling_rate = 1. / t_r
+    nyquist = sampling_rate / 2.
+
+    critical = []
+    if high_pass is not None:
+        btype = 'high'
+        critical.append(_check_cutoff(high_pass, nyquist))
+    if low_pass is not None:
+        btype = 'low'
+        critical.append(_check_cutoff(low_pass, nyquist))
+
+    if len(critical) == 2:
+        btype = 'band'
+        if critical[0] == critical[1]:
+            return None
+    else:
+        critical = critical[0]
+
+    return sp_signal.butter(N=order, Wn=critical, btype=btype, output='sos',
+                            fs=sampling_rate)
+
+
+def _check_cutoff(frequency, nyquist):
+
+    if frequency >= nyquist:
+        return nyquist - nyquist * 10 * EPS
+    elif frequency < 0:
+        return nyquist * EPS
+    return frequency
@@ -1,15 +1,20 @@
-from niio import loaded, write
 import numpy as np
 
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import StandardScaler
-from nilearn.signal import clean
 
 from statsni.confidence import hpd_grid as hpd
 
+from .cache import _array_hash, as_cache
+from .cleaning import clean_signals
+from .instrumentation import FitStats
+from .thresholding import component_bounds
+
 class Regressor(object):
 
-    def __init__(self, standardize=True, hdr_alpha=0.05, tr=0.720, low_pass=None, high_pass=None, s_filter=False):
+    def __init__(self, standardize=True, hdr_alpha=0.05, tr=0.720, low_pass=None, high_pass=None, s_filter=False,
+                 cache=None, precompute=False, threshold_method='global', approximate=False,
+                 n_bins=1000, chunk_size=None, dtype=np.float64, stats_log=None):
 
         """
         Class to perform dual regression of group-ICA components.
@@ -25,6 +30,41 @@ class Regressor(object):
             repetition time
         low / high pass: float
             low and high frequency thresholds for spectral filtering
+        cache: str, or SubjectCache
+            directory or cache in which to store filtered signals
+            for reuse across fits
+            default: None (no caching)
+        precompute: bool
+            factorize the group components once, and reuse the
+            pseudo-inverse for the temporal regression of every subject
+            fit against the same components array
+            default: False
+        threshold_method: str
+            how spatial maps are thresholded at hdr_alpha
+            'global': one HPD interval over all components (statsni.hpd_grid)
+            'hpd': shortest interval of each component
+            'percentile': equal-tailed interval of each component
+            default: 'global'
+        approximate: bool
+            compute per-component bounds from histograms instead of sorting
+            the error bound is stored in threshold_error_
+            default: False
+        n_bins: int
+            number of histogram bins per component, if approximate
+        chunk_size: int
+            if set, regressions read the (vertices x time) signals this many
+            vertices at a time, so signals can be a memory-mapped array
+            temporal regression is only chunked when precompute is True
+            default: None (fit on all vertices at once)
+        dtype: numpy dtype
+            floating point precision of the signals, components and
+            regressions; pseudo-inverses are computed in float64
+            default: np.float64
+        stats_log: str
+            JSON lines file to which the time and memory of each stage
+            are appended
+            stage records of the last fit are kept in ``fit_stats_``
+            default: None
         """
 
         self.standardize = standardize
@@ -33,6 +73,14 @@ class Regressor(object):
         self.high_pass = high_pass
         self.tr = tr
         self.hdr_alpha = hdr_alpha
+        self.cache = cache
+        self.precompute = precompute
+        self.threshold_method = threshold_method
+        self.approximate = approximate
+        self.n_bins = n_bins
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        self.stats_log = stats_log
 
     def fit(self, input_rest, gica_components):
 
@@ -52,10 +100,18 @@ class Regressor(object):
         except:
             raise ValueError('Must fit group components first.')
 
-        input_rest = self._merge_and_reduce(input_rest)
+        self.fit_stats_ = stats = FitStats(self.stats_log)
+
+        if self.chunk_size is None:
+            input_rest = input_rest.astype(self.dtype, copy=False)
+
+        with stats.stage('clean'):
+            input_rest = self._merge_and_reduce(input_rest)
 
-        temporal_components = self.temporal_regression(input_rest, gica_components)
-        spatial_components = self.spatial_regression(input_rest, temporal_components)
+        with stats.stage('temporal_regression'):
+            temporal_components = self.temporal_regression(input_rest, gica_components)
+        with stats.stage('spatial_regression'):
+            spatial_components = self.spatial_regression(input_rest, temporal_components)
 
         self.temporal_ = temporal_components
         self.spatial_ = spatial_components
@@ -74,12 +130,26 @@ class Regressor(object):
 
         if self.s_filter:
 
-            signals = clean(signals,
-                            standardize=self.standardize,
-                            low_pass=self.low_pass,
-                            high_pass=self.high_pass,
-                            t_r=self.tr)
-        
+            cache = as_cache(self.cache)
+
+            if cache is not None:
+                key = cache.key(signals, standardize=self.standardize,
+                                low_pass=self.low_pass, high_pass=self.high_pass,
+                                t_r=self.tr, dtype=np.dtype(self.dtype).str)
+                cached = cache.get(key)
+                if cached is not None:
+                    return cached
+
+            # clean a copy, so the caller's signals are left unchanged
+            signals = clean_signals(np.array(signals, dtype=self.dtype),
+                                    standardize=self.standardize,
+                                    low_pass=self.low_pass,
+                                    high_pass=self.high_pass,
+                                    t_r=self.tr)
+
+            if cache is not None:
+                signals = cache.put(key, signals, dtype=self.dtype)
+
         return signals
 
     def temporal_regression(self, signal, group_components):
@@ -92,13 +162,77 @@ class Regressor(object):
         :return:
         """
 
+        if self.precompute:
+            pinv = self._pseudo_inverse(group_components)
+
+            if self.chunk_size is None:
+                return np.dot(pinv, signal).T
+
+            temporal_coefficients = np.zeros((pinv.shape[0], signal.shape[1]), dtype=self.dtype)
+            for block in self._chunks(signal.shape[0]):
+                temporal_coefficients += np.dot(pinv[:, block],
+                                                np.asarray(signal[block], dtype=self.dtype))
+
+            return temporal_coefficients.T
+
         model = LinearRegression()
-        model.fit(group_components, signal)
+        model.fit(group_components.astype(self.dtype, copy=False), signal)
         
         temporal_coefficients = model.coef_
 
         return temporal_coefficients
 
+    def _pseudo_inverse(self, group_components):
+
+        """
+        Pseudo-inverse of the centered group components.
+
+        Centering the design handles the intercept explicitly: the
+        pseudo-inverse of a centered design annihilates constant columns,
+        so the coefficients of a model with an intercept are a single
+        matrix product with the uncentered signals.  The result is cached
+        on the content of the components, so it is reused across subjects,
+        and recomputed if the components change, even in place.
+
+        Parameters:
+        - - - - -
+        group_components: float, array
+            numpy array of group-ICA components
+
+        Returns:
+        - - - -
+        pinv: float, array
+            pseudo-inverse, shape (n_components, n_vertices)
+        """
+
+        design_hash = _array_hash(np.asarray(group_components))
+
+        if getattr(self, '_design_hash', None) != design_hash:
+            design = group_components.astype(np.float64)
+            design -= design.mean(0)
+            self.pinv_ = np.linalg.pinv(design).astype(self.dtype)
+            self._design_hash = design_hash
+
+        return self.pinv_
+
+    def _chunks(self, n_vertices):
+
+        """
+        Split vertices into blocks of at most chunk_size.
+
+        Parameters:
+        - - - - -
+        n_vertices: int
+            number of vertices
+
+        Returns:
+        - - - -
+        blocks: list of slices
+        """
+
+        return [slice(start, min(start+self.chunk_size, n_vertices))
+                for start in range(0, n_vertices, self.chunk_size)]
+
     def spatial_regression(self, signals, temporal_coefficients):
 
         """
@@ -118,17 +252,47 @@ class Regressor(object):
         if self.standardize:
             temporal_coefficients = S.fit_transform(temporal_coefficients)
 
-        model = LinearRegression()
-        model.fit(temporal_coefficients, signals.T)
-
-        spatial_coefficients = model.coef_
+        if self.chunk_size is None:
+            model = LinearRegression()
+            model.fit(temporal_coefficients, signals.T)
+
+            spatial_coefficients = model.coef_
+        else:
+            # fit an intercept model one block of vertices at a time
+            design = temporal_coefficients.astype(np.float64)
+            design -= design.mean(0)
+            pinv = np.linalg.pinv(design).astype(self.dtype)
+
+            spatial_coefficients = np.empty((signals.shape[0], pinv.shape[0]), dtype=self.dtype)
+            for block in self._chunks(signals.shape[0]):
+                spatial_coefficients[block] = np.dot(np.asarray(signals[block], dtype=self.dtype),
+                                                     pinv.T)
         spatial_coefficients = Z.fit_transform(spatial_coefficients)
 
         if self.hdr_alpha:
-            [bounds, _, _, _] = hpd(spatial_coefficients, alpha=self.hdr_alpha)
-            lower = bounds[0][0]
-            upper = bounds[0][1]
-            idx = np.asarray(np.logical_or(spatial_coefficients <= lower, spatial_coefficients >= upper))
-            spatial_coefficients = (idx*spatial_coefficients)
+            with self._stage('threshold'):
+                if self.threshold_method == 'global':
+                    [bounds, _, _, _] = hpd(spatial_coefficients, alpha=self.hdr_alpha)
+                    lower = bounds[0][0]
+                    upper = bounds[0][1]
+                else:
+                    lower, upper, self.threshold_error_ = component_bounds(
+                        spatial_coefficients, alpha=self.hdr_alpha,
+                        method=self.threshold_method, approximate=self.approximate,
+                        n_bins=self.n_bins)
+                idx = np.asarray(np.logical_or(spatial_coefficients <= lower, spatial_coefficients >= upper))
+                spatial_coefficients = (idx*spatial_coefficients)
 
         return spatial_coefficients
+
+    def _stage(self, name):
+
+        """
+        Time a stage of the current fit.  If no fit has been run, the
+        stage is not recorded.
+        """
+
+        stats = getattr(self, 'fit_stats_', None)
+        if stats is None:
+            stats = FitStats()
+        return stats.stage(name)
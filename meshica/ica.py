@@ -1,25 +1,26 @@
-from niio import loaded, write
-from operator import itemgetter
+from niio import write
+import logging
 
 import numpy as np
-from nilearn.signal import clean
-from nilearn.decomposition.base import fast_svd
 
 from scipy.stats import scoreatpercentile
-from sklearn.decomposition import fastica
-from sklearn.utils import check_random_state
-from sklearn.utils.extmath import randomized_svd
 
-from statsni.confidence import hpd_grid as hpd
+from .cache import as_cache
+from .cleaning import clean_signals
+from .instrumentation import FitStats
+from .loading import as_array, load
+from .svd import truncated_svd
+from .unmixing import fastica_restarts
 
-import joblib
-from joblib import Memory, delayed, Parallel
+logger = logging.getLogger(__name__)
 
 class ICA(object):
     
     def __init__(self, n_components=20, pca_filter=False, n_init=10,
                  do_cca=False,standardize=True, low_pass=None, high_pass=None, t_r=None,
-                 threshold='auto', random_state=None, hdr_alpha=0.05):
+                 threshold='auto', random_state=None, hdr_alpha=0.05, cache=None,
+                 n_jobs=4, backend=None, blas_threads=None, dtype=np.float64,
+                 stats_log=None, svd_solver='auto'):
 
         """
 
@@ -38,6 +39,21 @@ class ICA(object):
         :param low_pass: low-pass filter limit
         :param high_pass: high-pass filter limit
         :param tr: repetitiion time
+        :param cache: directory or SubjectCache in which to store cleaned
+                      subject matrices for reuse across fits
+        :param n_jobs: number of FastICA restarts run in parallel
+        :param backend: joblib parallel backend used for the restarts
+        :param blas_threads: BLAS threads per restart; by default the
+                             available cores are divided between restarts
+        :param dtype: floating point precision used for loading, cleaning,
+                      SVD and FastICA
+        :param stats_log: JSON lines file to which the time and memory of
+                          each stage are appended; stage records are also
+                          kept in the ``fit_stats_`` attribute
+        :param svd_solver: solver of the subject and group PCA: 'gram'
+                           (eigendecomposition of the smaller Gram matrix),
+                           'randomized', 'full', or 'auto' to pick the
+                           cheapest for the matrix shape and rank
         """
 
         self.n_components = n_components
@@ -52,6 +68,13 @@ class ICA(object):
 
         self.threshold=threshold
         self.random_state=random_state
+        self.cache = cache
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.blas_threads = blas_threads
+        self.dtype = dtype
+        self.stats_log = stats_log
+        self.svd_solver = svd_solver
 
     def fit(self, input_files):
 
@@ -61,6 +84,8 @@ class ICA(object):
         :param input_files: list of input resting state matrices
         """
 
+        self.fit_stats_ = FitStats(self.stats_log)
+
         signals = self._merge_and_reduce(input_files)
         self._raw_fit(signals)
         self._unmix_components()
@@ -72,20 +97,13 @@ class ICA(object):
         Core function of CanICA to rotate components to maximize independance
         """
 
-        print('Unmixing components')
-
-        random_state = check_random_state(self.random_state)
+        logger.info('Unmixing components')
 
-        seeds = random_state.randint(np.iinfo(np.int32).max, size=self.n_init)
-        results = Parallel(n_jobs=4)(
-            delayed(fastica)(self.components_.T,whiten=True,
-                             fun='cube',random_state=seed) for seed in seeds)
-
-        ica_maps_gen_ = (result[2].T for result in results)
-        ica_maps_and_sparsities = ((ica_map,
-                                    np.sum(np.abs(ica_map), axis=1).max())
-                                   for ica_map in ica_maps_gen_)
-        ica_maps, _ = min(ica_maps_and_sparsities, key=itemgetter(-1))
+        ica_maps = fastica_restarts(self.components_.T, n_init=self.n_init,
+                                    random_state=self.random_state,
+                                    n_jobs=self.n_jobs, backend=self.backend,
+                                    blas_threads=self.blas_threads, dtype=self.dtype,
+                                    stats=self.fit_stats_)
 
         # Thresholding
         ratio = None
@@ -99,11 +117,12 @@ class ICA(object):
                              str(self.threshold))
 
         if ratio is not None:
-            abs_ica_maps = abs(ica_maps)
-            threshold = scoreatpercentile(
-                abs_ica_maps,
-                100. - (100. / len(ica_maps)) * ratio)
-            ica_maps[abs_ica_maps < threshold] = 0.
+            with self.fit_stats_.stage('threshold'):
+                abs_ica_maps = abs(ica_maps)
+                threshold = scoreatpercentile(
+                    abs_ica_maps,
+                    100. - (100. / len(ica_maps)) * ratio)
+                ica_maps[abs_ica_maps < threshold] = 0.
         self.components_ = ica_maps
 
         # flip signs in each component so that peak is +ve
@@ -123,17 +142,35 @@ class ICA(object):
         :return signals: concatenated resting state arrays
         """
 
-        print('Loading {:}'.format(input_file.split('/')[-1]))
+        logger.info('Loading %s', input_file.split('/')[-1])
+
+        stats = self.fit_stats_
+        cache = as_cache(self.cache)
+        matrix = None
 
-        matrix = loaded.load(input_file)
-        if matrix.shape[0] < matrix.shape[1]:
-            matrix = matrix.T
-        matrix = clean(matrix,standardize=self.standardize,
-                        low_pass=self.low_pass, high_pass=self.high_pass,
-                        t_r=self.t_r)
+        if cache is not None:
+            key = cache.key(input_file, standardize=self.standardize,
+                            low_pass=self.low_pass, high_pass=self.high_pass,
+                            t_r=self.t_r, dtype=np.dtype(self.dtype).str)
+            with stats.stage('load', input_file):
+                matrix = cache.get(key)
+
+        if matrix is None:
+            with stats.stage('load', input_file):
+                matrix = as_array(load(input_file), self.dtype)
+            if matrix.shape[0] < matrix.shape[1]:
+                matrix = matrix.T
+            with stats.stage('clean', input_file):
+                matrix = clean_signals(matrix,standardize=self.standardize,
+                                       low_pass=self.low_pass, high_pass=self.high_pass,
+                                       t_r=self.t_r)
+
+                if cache is not None:
+                    matrix = cache.put(key, matrix, dtype=self.dtype)
 
         if self.pca_filter:
-            matrix = self._reduce(matrix)
+            with stats.stage('reduce', input_file):
+                matrix = self._reduce(matrix)
 
         return matrix.T
 
@@ -146,18 +183,17 @@ class ICA(object):
         :param data: raw resting state signals
         """
 
-        print('Fitting with CCA = {:}'.format(str(self.do_cca)))
+        logger.info('Fitting with CCA = %s', self.do_cca)
 
         if self.do_cca:
             S = np.sqrt(np.sum(data ** 2, axis=1))
             S[S == 0] = 1
-            data /= S[:, np.newaxis]
+            # cached signals are read-only, so do not normalize in place
+            data = data / S[:, np.newaxis]
 
-        self.components_, self.variance_, _ = randomized_svd(data.T, n_components=self.n_components,
-            transpose=True, random_state=None, n_iter=3)
-
-        if self.do_cca:
-            data *= S[:, np.newaxis]
+        with self.fit_stats_.stage('svd'):
+            self.components_, self.variance_, _ = truncated_svd(data.T, self.n_components,
+                solver=self.svd_solver, n_iter=3)
 
         self.components_ = self.components_.T
 
@@ -166,11 +202,10 @@ class ICA(object):
         """
         Perform temporal dimensionality reduction.
 
-        :param signals: single-subject resting state matrix.
-        :return U: reduced resting state matrix
+        :param signals: single-subject (vertices x time) resting state matrix.
+        :return U: reduced (vertices x n_components) resting state matrix
         """
 
-        U, S, V = fast_svd(signals.T, self.n_components)
-        U = U.T.copy()
-        U = U * S[:, np.newaxis]
+        U, S, _ = truncated_svd(signals, self.n_components, solver=self.svd_solver)
+        U = U * S[np.newaxis, :]
         return U
\ No newline at end of file
@@ -0,0 +1,232 @@
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# process peak RSS reached before the last per-stage reset, in bytes
+_process_peak = 0
+
+# number of stages running in the process, across FitStats and threads;
+# the process peak is only reset and read by the outermost stage
+_active_stages = 0
+_stages_lock = threading.Lock()
+
+
+class FitStats(object):
+
+    def __init__(self, log=None):
+
+        """
+        Wall time, CPU time and peak memory of each stage of a fit.
+
+        One record is kept per stage and subject, e.g. loading, cleaning
+        or reducing a single subject, or the FastICA restarts.  Records
+        can be streamed to a JSON lines file as they are completed, so
+        that long cohort runs can be monitored and compared.
+
+        CPU time is the CPU time of the whole process, so it includes
+        work done by background threads (e.g. prefetching) during the
+        stage.  Peak memory is only recorded for outermost stages, i.e.
+        stages started while no other stage is running in the process.
+        Stages nested in, or running alongside, another stage (e.g. the
+        threshold stage of a spatial regression, or a subject prefetched
+        during an SVD update) only record times, and their peak_rss is
+        None; their memory counts towards the enclosing stage's peak.  On
+        Linux, the process peak is reset at the start of each outermost
+        stage, so that it holds the peak of that stage alone; elsewhere,
+        the process-lifetime peak is recorded.
+
+        Parameters:
+        - - - - -
+        log: str
+            JSON lines file to append records to
+            default: None (records are only kept in memory)
+        """
+
+        self.log = log
+        self.records = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, subject=None):
+
+        """
+        Time a stage of a fit.
+
+        Parameters:
+        - - - - -
+        name: str
+            stage name, e.g. 'load', 'clean', 'svd_update', 'fastica'
+        subject: str
+            subject the stage was run on
+            default: None (stage of the group fit)
+        """
+
+        global _active_stages, _process_peak
+
+        with _stages_lock:
+            outermost = _active_stages == 0
+            _active_stages += 1
+            reset = outermost and _reset_peak_rss()
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+
+            with _stages_lock:
+                _active_stages -= 1
+                peak = None
+                if outermost:
+                    peak = _status_rss('VmHWM') if reset else peak_rss()
+                    # VmHWM is summed from approximate per-CPU counters, so a
+                    # later reading can be slightly lower than this one
+                    if peak is not None:
+                        _process_peak = max(_process_peak, peak)
+
+            self.add({'stage': name,
+                      'subject': subject,
+                      'wall_time': wall,
+                      'cpu_time': cpu,
+                      'peak_rss': peak})
+
+    def add(self, record):
+
+        """
+        Add a completed stage record.
+
+        Parameters:
+        - - - - -
+        record: dict
+            stage record, as produced by ``stage``
+        """
+
+        logger.debug('%s%s: %.3fs wall, %.3fs cpu', record['stage'],
+                     '' if record['subject'] is None else ' (%s)' % record['subject'],
+                     record['wall_time'], record['cpu_time'])
+
+        with self._lock:
+            self.records.append(record)
+            if self.log is not None:
+                with open(self.log, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+    def extend(self, records):
+
+        """
+        Add records collected elsewhere, e.g. in a worker process.
+        """
+
+        for record in records:
+            self.add(record)
+
+    def summary(self):
+
+        """
+        Aggregate records by stage.
+
+        Returns:
+        - - - -
+        summary: dict
+            for each stage, the number of records, total wall and CPU
+            time, and the largest peak RSS
+        """
+
+        summary = {}
+        for record in self.records:
+            stage = summary.setdefault(record['stage'], {'count': 0,
+                                                         'wall_time': 0.,
+                                                         'cpu_time': 0.,
+                                                         'peak_rss': None})
+            stage['count'] += 1
+            stage['wall_time'] += record['wall_time']
+            stage['cpu_time'] += record['cpu_time']
+            if record['peak_rss'] is not None:
+                stage['peak_rss'] = max(stage['peak_rss'] or 0, record['peak_rss'])
+
+        return summary
+
+
+def peak_rss():
+
+    """
+    Peak resident set size of the current process, in bytes.
+
+    Includes peaks reached before the per-stage resets of ``FitStats``.
+    Returns None on platforms without the ``resource`` module.
+    """
+
+    rss = _status_rss('VmHWM')
+    if rss is not None:
+        return max(rss, _process_peak)
+
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform != 'darwin':
+        rss *= 1024
+
+    return rss
+
+
+def _reset_peak_rss():
+
+    """
+    Reset the peak resident set size of the process (Linux only), after
+    recording it in the process-lifetime peak.
+
+    Returns:
+    - - - -
+    reset: bool
+        whether the peak was reset
+    """
+
+    global _process_peak
+
+    rss = _status_rss('VmHWM')
+    if rss is None:
+        return False
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        return False
+
+    _process_peak = max(_process_peak, rss)
+
+    return True
+
+
+def _status_rss(field):
+
+    """
+    Read a memory field of /proc/self/status (e.g. 'VmHWM', 'VmRSS'), in
+    bytes, or None if it is unavailable.
+    """
+
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        return None
+
+    return None
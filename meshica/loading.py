@@ -0,0 +1,170 @@
+import numpy as np
+from niio import loaded
+
+HDF5_EXTENSIONS = ('.h5', '.hdf5')
+
+
+def load(filename, dataset='data'):
+
+    """
+    Load a subject matrix without reading it into memory where possible.
+
+    .npy files and uncompressed CIFTI data blocks are returned as read-only
+    memory maps, and HDF5 datasets as lazily sliced ``HDF5Matrix`` objects
+    (which require h5py, see the 'hdf5' extra), so that only the rows that
+    are actually used (e.g. masked vertices, or a block of rows) are read
+    from disk.  Other formats (GIFTI, MAT, ...) are read
+    in full with ``niio.loaded.load``.
+
+    Parameters:
+    - - - - -
+    filename: str
+        subject matrix file
+    dataset: str
+        name of the dataset in HDF5 files
+        if absent, the file must contain a single dataset
+
+    Returns:
+    - - - -
+    matrix: array-like
+        subject matrix, shape (n_vertices, n_timepoints)
+        supports ``shape`` and row slicing
+    """
+
+    if filename.endswith('.npy'):
+        return np.load(filename, mmap_mode='r')
+
+    if filename.endswith(HDF5_EXTENSIONS):
+        return _load_hdf5(filename, dataset)
+
+    if filename.endswith('.nii'):
+        matrix = _load_cifti(filename)
+        if matrix is not None:
+            return matrix
+
+    return loaded.load(filename)
+
+
+def as_array(matrix, dtype=np.float64):
+
+    """
+    Read a (possibly lazy) subject matrix into memory.
+
+    Parameters:
+    - - - - -
+    matrix: array-like
+        subject matrix returned by ``load``
+    dtype: numpy dtype
+        floating point precision of the returned array
+
+    Returns:
+    - - - -
+    matrix: float, array
+        in-memory subject matrix
+    """
+
+    return np.asarray(matrix[...]).astype(dtype, copy=False)
+
+
+def _load_hdf5(filename, dataset):
+
+    h5py = _import_h5py()
+
+    with h5py.File(filename, 'r') as f:
+
+        if dataset not in f:
+            datasets = [name for name in f if isinstance(f[name], h5py.Dataset)]
+            if len(datasets) != 1:
+                raise ValueError('%s does not contain a dataset named %s, and has %i '
+                                 'datasets.' % (filename, dataset, len(datasets)))
+            dataset = datasets[0]
+
+        shape = f[dataset].shape
+        dtype = f[dataset].dtype
+
+    return HDF5Matrix(filename, dataset, shape, dtype)
+
+
+def _import_h5py():
+
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError('h5py is required to read and write HDF5 files.  '
+                          'Install it with "pip install meshica[hdf5]".')
+
+    return h5py
+
+
+class HDF5Matrix(object):
+
+    def __init__(self, filename, dataset, shape, dtype):
+
+        """
+        Dataset of an HDF5 file, read only when sliced.
+
+        The file is opened for each read and closed straight after, so
+        no file handle outlives the slice.
+
+        Parameters:
+        - - - - -
+        filename: str
+            HDF5 file
+        dataset: str
+            name of the dataset
+        shape: tuple
+            shape of the dataset
+        dtype: numpy dtype
+            data type of the dataset
+        """
+
+        self.filename = filename
+        self.dataset = dataset
+        self.shape = shape
+        self.dtype = dtype
+
+    @property
+    def ndim(self):
+
+        return len(self.shape)
+
+    def __len__(self):
+
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+
+        h5py = _import_h5py()
+
+        with h5py.File(self.filename, 'r') as f:
+            return f[self.dataset][rows]
+
+    def __array__(self, dtype=None, copy=None):
+
+        array = self[...]
+        if dtype is not None:
+            array = array.astype(dtype, copy=False)
+        return array
+
+
+def _load_cifti(filename):
+
+    """
+    Memory map the data block of a CIFTI file.
+
+    Returns None if the file is not CIFTI, or its data cannot be memory
+    mapped (compressed or scaled data).
+    """
+
+    import nibabel as nb
+
+    image = nb.load(filename, mmap='r')
+    if not isinstance(image, nb.Cifti2Image):
+        return None
+
+    matrix = np.asanyarray(image.dataobj)
+    if not isinstance(matrix, np.memmap):
+        return None
+
+    # CIFTI data is stored as (n_timepoints, n_vertices)
+    return matrix.T
@@ -0,0 +1,168 @@
+import numpy as np
+
+
+class VertexMask(object):
+
+    def __init__(self, mask):
+
+        """
+        Precomputed index of the vertices kept by a mask.
+
+        The integer index is computed once and reused to gather the rows
+        of every subject, and to scatter results back onto the full mesh.
+
+        Parameters:
+        - - - - -
+        mask: bool or int, array
+            inclusion mask, shape (n_vertices,) or (n_vertices, 1)
+            non-zero entries are kept
+        """
+
+        mask = np.asarray(mask)
+        if mask.ndim > 1:
+            mask = mask.reshape(mask.shape[0], -1)[:, 0]
+
+        self.n_vertices = mask.shape[0]
+        self.index = np.flatnonzero(mask)
+
+        # position of each vertex in the masked array, or -1 if excluded
+        self.inverse = np.full((self.n_vertices,), -1, dtype=np.intp)
+        self.inverse[self.index] = np.arange(self.index.shape[0])
+
+    @property
+    def n_kept(self):
+
+        return self.index.shape[0]
+
+    def apply(self, matrix, out=None):
+
+        """
+        Gather the masked rows of a matrix.
+
+        Parameters:
+        - - - - -
+        matrix: array-like
+            full-mesh matrix, shape (n_vertices, ...)
+            lazily sliced arrays (e.g. h5py datasets) only read masked rows
+        out: array
+            optional preallocated output, shape (n_kept, ...)
+
+        Returns:
+        - - - -
+        masked: array
+            masked matrix, shape (n_kept, ...)
+        """
+
+        if matrix.shape[0] != self.n_vertices:
+            raise ValueError('Mask must have the same number of samples as the matrix.')
+
+        if not isinstance(matrix, np.ndarray):
+            matrix = matrix[self.index]
+            if out is None:
+                return matrix
+            out[...] = matrix
+            return out
+
+        return np.take(matrix, self.index, axis=0, out=out)
+
+    def view(self, matrix):
+
+        """
+        Lazily masked view of a matrix.
+
+        Unlike ``apply``, no rows are read until the view is sliced, so
+        memory-mapped subjects can be processed a block of vertices at a
+        time.
+
+        Parameters:
+        - - - - -
+        matrix: array-like
+            full-mesh matrix, shape (n_vertices, ...)
+
+        Returns:
+        - - - -
+        view: MaskedRows
+            view of the masked rows, shape (n_kept, ...)
+        """
+
+        if matrix.shape[0] != self.n_vertices:
+            raise ValueError('Mask must have the same number of samples as the matrix.')
+
+        return MaskedRows(matrix, self.index)
+
+    def scatter(self, masked, fill=0, out=None):
+
+        """
+        Scatter masked rows back onto the full mesh.
+
+        Parameters:
+        - - - - -
+        masked: array
+            masked matrix, shape (n_kept, ...)
+        fill: scalar
+            value of excluded vertices
+        out: array
+            optional preallocated output, shape (n_vertices, ...)
+
+        Returns:
+        - - - -
+        matrix: array
+            full-mesh matrix, shape (n_vertices, ...)
+        """
+
+        if masked.shape[0] != self.n_kept:
+            raise ValueError('Masked matrix must have one row per kept vertex.')
+
+        if out is None:
+            out = np.empty((self.n_vertices,) + masked.shape[1:], dtype=masked.dtype)
+        out.fill(fill)
+        out[self.index] = masked
+
+        return out
+
+
+class MaskedRows(object):
+
+    def __init__(self, matrix, index):
+
+        """
+        Rows of a matrix selected by an index, read only when sliced.
+
+        Parameters:
+        - - - - -
+        matrix: array-like
+            full matrix, e.g. a memory map or h5py dataset
+        index: int, array
+            increasing indices of the selected rows
+        """
+
+        self.matrix = matrix
+        self.index = index
+
+    @property
+    def shape(self):
+
+        return (self.index.shape[0],) + tuple(self.matrix.shape[1:])
+
+    @property
+    def dtype(self):
+
+        return self.matrix.dtype
+
+    def __len__(self):
+
+        return self.index.shape[0]
+
+    def __getitem__(self, rows):
+
+        index = self.index[rows]
+        if isinstance(self.matrix, np.ndarray):
+            return np.take(self.matrix, index, axis=0)
+        return self.matrix[index]
+
+    def __array__(self, dtype=None, copy=None):
+
+        array = self[:]
+        if dtype is not None:
+            array = array.astype(dtype, copy=False)
+        return array
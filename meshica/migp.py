@@ -1,25 +1,39 @@
-from niio import loaded, write
-from operator import itemgetter
+from niio import write
 
 import numpy as np
-from nilearn.signal import clean
-from nilearn.decomposition.base import fast_svd
 
 from scipy.stats import scoreatpercentile
-from scipy.linalg import eigh
-from sklearn.decomposition import fastica
 
-from joblib import Parallel, delayed
 from sklearn.utils import check_random_state
 from sklearn.utils.extmath import randomized_svd
 
-import random
+from .cache import as_cache
+from .cleaning import clean_signals
+from .instrumentation import FitStats
+from .loading import as_array, load
+from .masking import VertexMask
+from .parallel import blas_threads_per_worker, call_with_blas_limit
+from .prefetch import prefetch
+from .svd import svd_update
+from .unmixing import fastica_restarts
+from .validation import as_quarantine, screen
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import logging
+import os
+
+logger = logging.getLogger(__name__)
 
 class MIGP(object):
 
     def __init__(self, n_components=10, m_eigen=9600, s_init=3, n_init=10,
                  standardize=True, low_pass=None, high_pass=None, t_r=None,
-                 threshold=None, random_state=None, mask=None):
+                 threshold=None, random_state=None, mask=None,
+                 svd_method='randomized', prefetch=0, checkpoint=None,
+                 checkpoint_every=10, n_workers=1, executor=None, cache=None,
+                 n_jobs=4, backend=None, blas_threads=None, dtype=np.float64,
+                 quarantine=None, stats_log=None):
 
         """
 
@@ -50,6 +64,59 @@ class MIGP(object):
             random number generator
         mask: int array
             boolean mask, indicating which voxel to keep
+        svd_method: str
+            method used to fold each new subject into the reduced basis
+            'randomized': re-decompose the stacked matrix with randomized SVD
+            'incremental': rank-update the existing decomposition in place
+            default: 'randomized'
+        prefetch: int
+            number of subjects to load and clean in the background while
+            the current subject is being decomposed
+            each prefetched subject is held in memory until it is used
+            default: 0 (serial loading)
+        checkpoint: str
+            file to periodically save the reduced basis and run state to
+            pass the same file to ``fit(..., resume=checkpoint)`` to
+            continue an interrupted run
+            default: None (no checkpointing)
+        checkpoint_every: int
+            number of subjects between checkpoints
+        n_workers: int
+            number of partitions of the input files to reduce in parallel
+            partial estimates are merged pairwise in a reduction tree
+            default: 1 (serial MIGP)
+        executor: concurrent.futures.Executor
+            executor used to run the partitions and merges
+            any object with a ``submit`` method returning futures (e.g. a
+            dask.distributed.Client) can be used to run across nodes
+            default: None (local process pool with n_workers processes)
+        cache: str, or SubjectCache
+            directory or cache in which to store cleaned subject matrices
+            for reuse across fits
+            default: None (no caching)
+        n_jobs: int
+            number of FastICA restarts run in parallel
+        backend: str
+            joblib parallel backend used for the FastICA restarts
+        blas_threads: int
+            BLAS threads per parallel worker (FastICA restarts, and MIGP
+            partitions when n_workers > 1)
+            default: None (divide the available cores between workers)
+        dtype: numpy dtype
+            floating point precision used for loading, cleaning, the
+            spatial eigenvectors and FastICA
+            np.float32 halves memory use and is recommended for large cohorts
+            default: np.float64
+        quarantine: str, or Quarantine
+            JSON manifest of excluded subjects
+            subjects listed in it are skipped without being loaded, and
+            subjects that fail screening are added to it
+            default: None
+        stats_log: str
+            JSON lines file to which the time and memory of each stage
+            are appended as the fit runs
+            stage records are also kept in the ``fit_stats_`` attribute
+            default: None
         """
 
         self.n_components = n_components        
@@ -66,40 +133,184 @@ class MIGP(object):
         self.random_state=random_state
 
         self.mask = mask
+        self.svd_method = svd_method
+        self.prefetch = prefetch
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.n_workers = n_workers
+        self.executor = executor
+        self.cache = cache
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.blas_threads = blas_threads
+        self.dtype = dtype
+        self.quarantine = quarantine
+        self.stats_log = stats_log
+
+    @property
+    def components_(self):
+
+        """
+        Group ICA components, (vertices x components).
+
+        After ``partial_fit``, components are unmixed from the current
+        reduced basis the first time they are accessed, and recomputed
+        only once new subjects have been folded in.
+        """
+
+        if getattr(self, '_components', None) is None:
+            if not hasattr(self, 'spatial_') and not getattr(self, '_pending', None):
+                raise AttributeError('MIGP has not been fit yet.')
+            self._initialize()
+            self._unmix_components()
+
+        return self._components
+
+    @components_.setter
+    def components_(self, components):
+        self._components = components
 
-    def fit(self, input_files):
+    def fit(self, input_files, resume=None):
 
         """
 
-        :param input_files:
+        :param input_files: list of input resting state matrix files
+        :param resume: checkpoint file written by a previous, interrupted
+                       call to fit with the same input files
         :return:
-        
+
         """
 
-        random.shuffle(input_files)
-        self._raw_fit(input_files)
+        self.fit_stats_ = FitStats(self.stats_log)
+        random_state = check_random_state(self.random_state)
+
+        if resume is not None:
+            logger.info('Resuming from checkpoint %s', resume)
+            checkpoint = self._load_checkpoint(resume, input_files)
+            order = checkpoint['order']
+            random_state.set_state(checkpoint['random_state'])
+        else:
+            checkpoint = {}
+            order = random_state.permutation(len(input_files))
+
+        # the same generator drives every randomized SVD of the fit, and its
+        # state is checkpointed, so that resumed fits match uninterrupted ones
+        self._files = list(input_files)
+        self._order = order
+        self._random_state = random_state
+
+        input_files = [input_files[i] for i in order]
+
+        if self.n_workers > 1 or self.executor is not None:
+            if resume is not None or self.checkpoint is not None:
+                raise ValueError('Checkpointing and resuming from a checkpoint '
+                                 'are only supported for serial MIGP.')
+            self._parallel_fit(input_files)
+        else:
+            self._raw_fit(input_files,
+                          variance=checkpoint.get('variance'),
+                          spatial=checkpoint.get('spatial'),
+                          start=checkpoint.get('n_processed', 0))
+
+        if self._quarantine is not None:
+            self._quarantine.save()
+
         self._unmix_components()
 
+    def partial_fit(self, subjects):
+
+        """
+
+        Fold one subject, or a batch of subjects, into the reduced basis.
+
+        The first ``s_init`` subjects initialize the spatial eigenvectors,
+        and every later subject updates them, as in ``fit``, so that group
+        components can be updated as new subjects arrive without
+        recomputing from scratch.  A fitted model can also be updated.
+        ``components_`` is unmixed from the current basis on access.
+
+        Subjects are folded in the order they are given.  Quarantined and
+        non-finite subjects are skipped, as in ``fit``.
+
+        :param subjects: resting state matrix file, in-memory
+                         (vertices x timepoints) matrix, or a list of either
+        :return: self
+        """
+
+        if isinstance(subjects, str) or (isinstance(subjects, np.ndarray) and subjects.ndim == 2):
+            subjects = [subjects]
+
+        if not hasattr(self, 'fit_stats_'):
+            self.fit_stats_ = FitStats(self.stats_log)
+        if not hasattr(self, '_random_state'):
+            self._random_state = check_random_state(self.random_state)
+        if not hasattr(self, '_pending'):
+            self._setup()
+            self.n_subjects_ = getattr(self, 'n_subjects_', 0)
+
+        for subject in subjects:
+
+            if isinstance(subject, str):
+                name = subject
+                matrix = self._load_subject(subject)
+            else:
+                # in-memory subjects are cleaned in place, so they are copied
+                # unless masking already copies them
+                if self._vertex_mask is None:
+                    subject = np.array(subject, dtype=self.dtype)
+                name = 'subject %i' % (self.n_subjects_)
+                matrix = self._prepare_subject(subject, name)
+
+            self.n_subjects_ += 1
+            if matrix is None:
+                continue
+
+            if hasattr(self, 'spatial_'):
+                logger.debug('Adding subject: %s', name)
+                with self.fit_stats_.stage('svd_update', name):
+                    self.variance_, self.spatial_ = self._update(self.variance_, self.spatial_, matrix)
+            else:
+                self._pending.append(matrix)
+                if len(self._pending) >= self.s_init:
+                    self._initialize()
+
+            self._components = None
+
+        if self._quarantine is not None:
+            self._quarantine.save()
+
+        return self
+
+    def _initialize(self):
+
+        """
+        Compute the initial spatial eigenvectors from subjects buffered
+        by ``partial_fit``.
+        """
+
+        if not getattr(self, '_pending', None):
+            return
+
+        logger.info('Computing initial estimate for %i subjects.', len(self._pending))
+        with self.fit_stats_.stage('svd_init'):
+            self.variance_, self.spatial_ = self._estimate(np.vstack(self._pending))
+        self._pending = []
+
     def _unmix_components(self):
 
         """
         Core function of CanICA to rotate components to maximize independance
         """
 
-        print('Unmixing components')
+        logger.info('Unmixing components')
 
-        random_state = check_random_state(self.random_state)
+        components = self.variance_[0:self.n_components, None]*self.spatial_[0:self.n_components, :]
 
-        seeds = random_state.randint(np.iinfo(np.int32).max, size=self.n_init)
-        results = Parallel(n_jobs=4)(
-            delayed(fastica)(self.components_.T,whiten=True,
-                             fun='cube',random_state=seed) for seed in seeds)
-
-        ica_maps_gen_ = (result[2].T for result in results)
-        ica_maps_and_sparsities = ((ica_map,
-                                    np.sum(np.abs(ica_map), axis=1).max())
-                                   for ica_map in ica_maps_gen_)
-        ica_maps, _ = min(ica_maps_and_sparsities, key=itemgetter(-1))
+        ica_maps = fastica_restarts(components.T, n_init=self.n_init,
+                                    random_state=self.random_state,
+                                    n_jobs=self.n_jobs, backend=self.backend,
+                                    blas_threads=self.blas_threads, dtype=self.dtype,
+                                    stats=self.fit_stats_)
 
         # Thresholding
         ratio = None
@@ -113,11 +324,12 @@ class MIGP(object):
                              str(self.threshold))
 
         if ratio is not None:
-            abs_ica_maps = abs(ica_maps)
-            threshold = scoreatpercentile(
-                abs_ica_maps,
-                100. - (100. / len(ica_maps)) * ratio)
-            ica_maps[abs_ica_maps < threshold] = 0.
+            with self.fit_stats_.stage('threshold'):
+                abs_ica_maps = abs(ica_maps)
+                threshold = scoreatpercentile(
+                    abs_ica_maps,
+                    100. - (100. / len(ica_maps)) * ratio)
+                ica_maps[abs_ica_maps < threshold] = 0.
         self.components_ = ica_maps
 
         # flip signs in each component so that peak is (+)
@@ -127,69 +339,312 @@ class MIGP(object):
 
         self.components_ = self.components_.T
 
-    def _raw_fit(self,input_files):
+    def _raw_fit(self, input_files, variance=None, spatial=None, start=0):
 
         """
 
-        :param input_files:
+        :param input_files: list of input resting state matrix files
+        :param variance: singular values of a partially fit model
+        :param spatial: spatial eigenvectors of a partially fit model
+        :param start: number of input files already folded into
+                      variance and spatial
         :return:
         """
 
-        W = []
-        for temp_file in input_files[:self.s_init]:
+        self._setup()
+        subjects = prefetch(self._load_subject, input_files[start:], depth=self.prefetch)
 
-            temp_matrix = loaded.load(temp_file)
-            nans = np.isnan(temp_matrix).sum()
-            infs = np.isinf(temp_matrix).sum()
+        if variance is None:
 
-            if nans > 0 or infs > 0:
-                print('%s has %i NANs and %i INFs' % (temp_file, nans, infs))
-                continue
-            else:
-                W.append(self._merge_and_reduce(temp_matrix))
+            W = []
+            for temp_file, temp_matrix in islice(subjects, self.s_init):
+                if temp_matrix is not None:
+                    W.append(temp_matrix)
 
-        # Compute initial estimate of spatial eigenvectors
-        print('Computing initial estimate for {:} subjects.'.format(self.s_init))
-        W = np.row_stack(W).squeeze()
-        print('Initialization matrix: {:}'.format(W.shape))
-        W = self._estimate(W)
+            # Compute initial estimate of spatial eigenvectors
+            logger.info('Computing initial estimate for %i subjects.', self.s_init)
+            W = np.vstack(W).squeeze()
+            logger.debug('Initialization matrix: %s', W.shape)
+            with self.fit_stats_.stage('svd_init'):
+                variance, spatial = self._estimate(W)
 
-        print('Initial estimate shape: {:}'.format(W.shape))
+            logger.debug('Initial estimate shape: %s', spatial.shape)
 
-        for k, temp_file in enumerate(input_files[self.s_init:]):
+            start = min(self.s_init, len(input_files))
+            self._save_checkpoint(variance, spatial, start)
 
-            print('Adding file # %i' % (k+1+self.s_init))
+        for k, (temp_file, update_data) in enumerate(subjects, start):
 
-            temp_matrix = loaded.load(temp_file)
-            nans = np.isnan(temp_matrix).sum()
-            infs = np.isinf(temp_matrix).sum()
+            logger.info('Adding file # %i', k+1)
 
-            if nans > 0 or infs > 0:
-                print('%s has %i NANs and %i INFs' % (temp_file, nans, infs))
-                continue
+            if update_data is None:
+                pass
             else:
-                print('Adding file: %s' % (temp_file))
-                update_data = self._merge_and_reduce(temp_matrix)
-                W = np.row_stack([W, update_data])
+                logger.debug('Adding file: %s', temp_file)
+                with self.fit_stats_.stage('svd_update', temp_file):
+                    variance, spatial = self._update(variance, spatial, update_data)
 
-                temporal, variance, spatial = randomized_svd(W, self.m_eigen, n_iter=3)
-                W = np.dot(np.diag(variance), spatial)
+            if (k+1) % self.checkpoint_every == 0:
+                self._save_checkpoint(variance, spatial, k+1)
 
-        self.components_ = W[0:self.n_components, :]
+        self._save_checkpoint(variance, spatial, len(input_files))
 
-    def _merge_and_reduce(self, matrix):
+        self.variance_ = variance
+        self.spatial_ = spatial
+        self.n_subjects_ = len(input_files)
+        self._components = None
 
-        if self.mask is not None:
-            if self.mask.shape[0] != matrix.shape[0]:
-                raise('Mask must have the same number of samples as the matrix.')
-            else:
-                matrix = matrix[np.where(self.mask),:]
+    def _parallel_fit(self, input_files):
+
+        """
+
+        Run MIGP on disjoint partitions of the input files in parallel,
+        and merge the partial spatial eigenvectors pairwise in a
+        reduction tree.
+
+        :param input_files: list of input resting state matrix files
+        """
+
+        self._setup()
+
+        n_partitions = max(1, min(self.n_workers, len(input_files) // self.s_init))
+        partitions = [input_files[i::n_partitions] for i in range(n_partitions)]
+        params = self._worker_params()
+
+        executor = self.executor
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=self.n_workers)
+
+        try:
+            logger.info('Fitting %i partitions.', n_partitions)
+            blas_threads = blas_threads_per_worker(self.n_workers, self.blas_threads)
+            futures = [executor.submit(call_with_blas_limit, blas_threads,
+                                       _fit_partition, self._worker_seed(params), partition)
+                       for partition in partitions]
+            bases = []
+            for future in futures:
+                variance, spatial, quarantined, records = future.result()
+                bases.append((variance, spatial))
+                self.fit_stats_.extend(records)
+                if self._quarantine is not None:
+                    self._quarantine.subjects.update(quarantined)
+
+            while len(bases) > 1:
+                logger.info('Merging %i partial estimates.', len(bases))
+                with self.fit_stats_.stage('merge'):
+                    futures = [executor.submit(call_with_blas_limit, blas_threads,
+                                               _merge_partitions, self._worker_seed(params),
+                                               bases[i], bases[i+1])
+                               for i in range(0, len(bases)-1, 2)]
+                    merged = [future.result() for future in futures]
+                if len(bases) % 2:
+                    merged.append(bases[-1])
+                bases = merged
+        finally:
+            if self.executor is None:
+                executor.shutdown()
+
+        variance, spatial = bases[0]
+
+        self.variance_ = variance
+        self.spatial_ = spatial
+        self.n_subjects_ = len(input_files)
+        self._components = None
+
+    def _setup(self):
+
+        """
+
+        Open the subject cache, quarantine and vertex mask of a fit.
+        """
+
+        self._cache = as_cache(self.cache)
+        self._quarantine = as_quarantine(self.quarantine)
+        self._vertex_mask = None if self.mask is None else VertexMask(self.mask)
+        self._pending = []
+
+    def _worker_params(self):
+
+        """
+
+        Parameters used to construct MIGP instances in worker processes.
+
+        :return: dictionary of constructor arguments
+        """
+
+        return {'n_components': self.n_components,
+                'm_eigen': self.m_eigen,
+                's_init': self.s_init,
+                'n_init': self.n_init,
+                'standardize': self.standardize,
+                'low_pass': self.low_pass,
+                'high_pass': self.high_pass,
+                't_r': self.t_r,
+                'threshold': self.threshold,
+                'mask': self.mask,
+                'svd_method': self.svd_method,
+                'prefetch': self.prefetch,
+                'cache': self.cache,
+                'blas_threads': self.blas_threads,
+                'dtype': self.dtype,
+                'quarantine': None if self._quarantine is None else self._quarantine.manifest}
+
+    def _worker_seed(self, params):
+
+        """
+
+        Worker parameters with a random seed drawn from the fit's generator,
+        so that partitions and merges are reproducible for a given
+        random_state.
+
+        :param params: dictionary of constructor arguments
+        :return: dictionary of constructor arguments, with random_state set
+        """
 
-        print(matrix.shape)
+        return dict(params, random_state=self._random_state.randint(np.iinfo(np.int32).max))
 
-        matrix = clean(matrix, standardize=self.standardize,
-                       low_pass=self.low_pass, high_pass=self.high_pass,
-                       t_r=self.t_r)
+    def _save_checkpoint(self, variance, spatial, n_processed):
+
+        """
+
+        Write the current reduced basis and run state to disk.
+
+        The checkpoint is written to a temporary file and then moved into
+        place, so an interruption never leaves a truncated checkpoint.
+
+        :param variance: current singular values
+        :param spatial: current spatial eigenvectors
+        :param n_processed: number of shuffled input files folded in so far
+        """
+
+        if self.checkpoint is None:
+            return
+
+        logger.info('Saving checkpoint after %i files.', n_processed)
+
+        if self._quarantine is not None:
+            self._quarantine.save()
+
+        _, keys, pos, has_gauss, cached_gaussian = self._random_state.get_state()
+        temp_checkpoint = self.checkpoint + '.tmp'
+
+        with self.fit_stats_.stage('checkpoint'):
+            with open(temp_checkpoint, 'wb') as f:
+                np.savez(f, variance=variance, spatial=spatial,
+                         files=np.asarray(self._files, dtype=str),
+                         order=self._order, n_processed=n_processed,
+                         rng_keys=keys, rng_pos=pos, rng_has_gauss=has_gauss,
+                         rng_cached_gaussian=cached_gaussian)
+
+            os.replace(temp_checkpoint, self.checkpoint)
+
+    def _load_checkpoint(self, checkpoint, input_files):
+
+        """
+
+        Read a checkpoint written by _save_checkpoint.
+
+        :param checkpoint: checkpoint file
+        :param input_files: list of input resting state matrix files
+        :return: dictionary of saved run state
+        """
+
+        with np.load(checkpoint) as state:
+
+            if list(state['files']) != list(input_files):
+                raise ValueError('Checkpoint %s was written for a different '
+                                 'list of input files.' % (checkpoint))
+
+            return {'variance': state['variance'],
+                    'spatial': state['spatial'],
+                    'order': state['order'],
+                    'n_processed': int(state['n_processed']),
+                    'random_state': ('MT19937', state['rng_keys'],
+                                     int(state['rng_pos']),
+                                     int(state['rng_has_gauss']),
+                                     float(state['rng_cached_gaussian']))}
+
+    def _load_subject(self, temp_file):
+
+        """
+
+        Load, screen and reduce a single subject.
+
+        :param temp_file: resting state matrix file
+        :return: reduced resting state matrix, or None if the subject
+                 contains NaN or Inf values, or is quarantined
+        """
+
+        quarantine = self._quarantine
+        if quarantine is not None and temp_file in quarantine:
+            logger.info('%s is quarantined', temp_file)
+            return None
+
+        stats = self.fit_stats_
+        cache = self._cache
+        key = None
+        if cache is not None:
+            key = cache.key(temp_file, standardize=self.standardize,
+                            low_pass=self.low_pass, high_pass=self.high_pass,
+                            t_r=self.t_r, mask=self.mask,
+                            dtype=np.dtype(self.dtype).str)
+            with stats.stage('load', temp_file):
+                temp_matrix = cache.get(key)
+            if temp_matrix is not None:
+                return temp_matrix
+
+        # only masked rows of memory-mapped subjects are read from disk
+        return self._prepare_subject(load(temp_file), temp_file,
+                                     key=key,
+                                     quarantine=quarantine)
+
+    def _prepare_subject(self, matrix, name, key=None, quarantine=None):
+
+        """
+
+        Mask, screen and reduce a single subject.
+
+        :param matrix: (vertices x timepoints) resting state matrix
+        :param name: subject file, or label of an in-memory subject
+        :param key: cache key the reduced matrix is stored under
+        :param quarantine: quarantine the subject is added to if it
+                           fails screening
+        :return: reduced resting state matrix, or None if the subject
+                 contains NaN or Inf values
+        """
+
+        stats = self.fit_stats_
+
+        with stats.stage('load', name):
+            if self._vertex_mask is not None:
+                matrix = self._vertex_mask.apply(matrix)
+            matrix = as_array(matrix, self.dtype)
+
+            report, _ = screen(matrix)
+            nans = report['nans']
+            infs = report['infs']
+
+        if nans > 0 or infs > 0:
+            logger.warning('%s has %i NANs and %i INFs', name, nans, infs)
+            if quarantine is not None:
+                quarantine.add(name, report, 'non-finite values')
+            return None
+
+        with stats.stage('clean', name):
+            matrix = self._merge_and_reduce(matrix)
+
+            if key is not None:
+                matrix = self._cache.put(key, matrix, dtype=self.dtype)
+
+        return matrix
+
+    def _merge_and_reduce(self, matrix):
+
+        logger.debug('Cleaning matrix of shape %s', matrix.shape)
+
+        matrix = clean_signals(matrix, standardize=self.standardize,
+                               low_pass=self.low_pass, high_pass=self.high_pass,
+                               t_r=self.t_r)
 
         return matrix.T.squeeze()
 
@@ -197,12 +652,83 @@ class MIGP(object):
 
         """
 
-        Compute weighted spatial eigenvectors of signal.
+        Compute spatial eigenvectors of signal.
 
         :param signals:
-        :return:
+        :return variance: singular values
+        :return spatial: spatial eigenvectors
+        """
+
+        _,variance,spatial = randomized_svd(signals, self.m_eigen, n_iter=3,
+                                            random_state=self._random_state)
+
+        return variance, spatial
+
+    def _update(self, variance, spatial, signals):
+
         """
 
-        _,variance,spatial = randomized_svd(signals, self.m_eigen, n_iter=3)
+        Fold a new subject into the current spatial eigenvectors.
+
+        :param variance: current singular values
+        :param spatial: current spatial eigenvectors
+        :param signals: reduced resting state matrix of new subject
+        :return variance: updated singular values
+        :return spatial: updated spatial eigenvectors
+        """
+
+        if self.svd_method == 'incremental':
+            return svd_update(variance, spatial, signals, self.m_eigen)
+        elif self.svd_method == 'randomized':
+            W = np.vstack([variance[:, None]*spatial, signals])
+            return self._estimate(W)
+        else:
+            raise ValueError("svd_method must be 'randomized' or "
+                             "'incremental'. You provided %s." %
+                             str(self.svd_method))
+
+
+def _fit_partition(params, input_files):
+
+    """
+
+    Run serial MIGP on a partition of the input files.
+
+    :param params: MIGP constructor arguments
+    :param input_files: list of input resting state matrix files
+    :return variance: singular values of the partition
+    :return spatial: spatial eigenvectors of the partition
+    :return quarantined: subjects quarantined in the partition
+    :return records: stage records of the partition
+    """
+
+    model = MIGP(**params)
+    model.fit_stats_ = FitStats()
+    model._random_state = check_random_state(model.random_state)
+    model._raw_fit(input_files)
+
+    quarantined = {}
+    if model._quarantine is not None:
+        quarantined = model._quarantine.subjects
+
+    return model.variance_, model.spatial_, quarantined, model.fit_stats_.records
+
+
+def _merge_partitions(params, first, second):
+
+    """
+
+    Merge the spatial eigenvectors of two partitions.
+
+    :param params: MIGP constructor arguments
+    :param first: (variance, spatial) of the first partition
+    :param second: (variance, spatial) of the second partition
+    :return variance: merged singular values
+    :return spatial: merged spatial eigenvectors
+    """
+
+    model = MIGP(**params)
+    model._random_state = check_random_state(model.random_state)
+    W = np.vstack([first[0][:, None]*first[1], second[0][:, None]*second[1]])
 
-        return variance[:, None]*spatial
\ No newline at end of file
+    return model._estimate(W)
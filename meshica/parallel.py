@@ -0,0 +1,56 @@
+from joblib import cpu_count, effective_n_jobs
+from threadpoolctl import threadpool_limits
+
+
+def blas_threads_per_worker(n_jobs, blas_threads=None):
+
+    """
+    Number of BLAS threads each parallel worker may use.
+
+    Parameters:
+    - - - - -
+    n_jobs: int
+        number of parallel workers, in joblib convention
+        (negative values count back from the number of cores)
+    blas_threads: int
+        requested BLAS threads per worker
+        if None, the available cores are divided evenly between workers
+
+    Returns:
+    - - - -
+    blas_threads: int
+        BLAS threads per worker, such that workers x threads does not
+        exceed the available cores
+    """
+
+    n_workers = effective_n_jobs(n_jobs)
+    max_threads = max(1, cpu_count() // n_workers)
+
+    if blas_threads is None:
+        return max_threads
+    return max(1, min(blas_threads, max_threads))
+
+
+def call_with_blas_limit(blas_threads, function, *args, **kwargs):
+
+    """
+    Call a function with a limited number of BLAS threads.
+
+    Defined at module level, so that it can be sent to worker processes.
+
+    Parameters:
+    - - - - -
+    blas_threads: int
+        maximum number of BLAS threads
+    function: callable
+        function to call
+    args, kwargs:
+        arguments passed to function
+
+    Returns:
+    - - - -
+    result of function(*args, **kwargs)
+    """
+
+    with threadpool_limits(limits=blas_threads, user_api='blas'):
+        return function(*args, **kwargs)
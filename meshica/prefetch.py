@@ -0,0 +1,55 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def prefetch(function, items, depth=2):
+
+    """
+    Apply a function to a sequence of items, computing results for the
+    next ``depth`` items in background threads while the caller consumes
+    the current one.
+
+    Results are yielded in input order.  At most ``depth`` results are
+    pending at any time, in addition to the one held by the caller, so
+    memory stays bounded.
+
+    Parameters:
+    - - - - -
+    function: callable
+        function applied to each item (e.g. load and clean a subject)
+    items: iterable
+        items to process
+    depth: int
+        number of items to compute ahead of the caller
+        if 0, items are processed serially in the calling thread
+
+    Returns:
+    - - - -
+    generator of (item, function(item)) tuples
+    """
+
+    if depth < 1:
+        for item in items:
+            yield item, function(item)
+        return
+
+    items = iter(items)
+    pending = deque()
+    pool = ThreadPoolExecutor(max_workers=depth)
+
+    try:
+        for item in items:
+            pending.append((item, pool.submit(function, item)))
+            if len(pending) == depth:
+                break
+
+        while pending:
+            item, future = pending.popleft()
+            for following in items:
+                pending.append((following, pool.submit(function, following)))
+                break
+            yield item, future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
@@ -0,0 +1,138 @@
+import json
+import os
+
+import numpy as np
+
+FORMATS = ('npy', 'hdf5')
+
+
+def save_results(output, arrays, mask=None, metadata=None, format='npy'):
+
+    """
+    Write fitted components or dual regression maps to a compact store.
+
+    Arrays are stored in their masked (compact) form, together with the
+    index of the kept vertices and the fit metadata, so that they can be
+    read back partially without loading the whole store.
+
+    'npy' stores are directories with one .npy file per array, which are
+    read back as memory maps.  'hdf5' stores are single files with one
+    chunked dataset per array, chunked by column, so that reading a single
+    component only touches that component.
+
+    Parameters:
+    - - - - -
+    output: str
+        store directory ('npy') or file ('hdf5')
+    arrays: dict
+        named arrays to store, e.g. {'components': ..., 'spatial': ...}
+    mask: VertexMask
+        mask the arrays were computed on
+        default: None (arrays cover all vertices)
+    metadata: dict
+        JSON-serializable fit parameters
+    format: str
+        'npy' or 'hdf5'
+    """
+
+    if format not in FORMATS:
+        raise ValueError("format must be one of %s. You provided %s." %
+                         (', '.join(FORMATS), str(format)))
+
+    metadata = dict(metadata or {})
+    metadata['arrays'] = sorted(arrays)
+
+    if mask is not None:
+        arrays = dict(arrays, mask_index=mask.index)
+        metadata['n_vertices'] = mask.n_vertices
+
+    if format == 'npy':
+        _save_npy(output, arrays, metadata)
+    else:
+        _save_hdf5(output, arrays, metadata)
+
+
+def load_results(output, mmap_mode='r'):
+
+    """
+    Open a store written by ``save_results``.
+
+    Parameters:
+    - - - - -
+    output: str
+        store directory ('npy') or file ('hdf5')
+    mmap_mode: str
+        memory map mode of arrays in 'npy' stores
+
+    Returns:
+    - - - -
+    arrays: dict
+        memory-mapped arrays ('npy'), or lazily sliced h5py datasets ('hdf5')
+        includes 'mask_index' if the arrays were masked
+    metadata: dict
+        fit metadata
+    """
+
+    if os.path.isdir(output):
+
+        with open(os.path.join(output, 'metadata.json'), 'r') as f:
+            metadata = json.load(f)
+
+        names = list(metadata['arrays'])
+        if 'n_vertices' in metadata:
+            names.append('mask_index')
+
+        arrays = {name: np.load(os.path.join(output, name + '.npy'), mmap_mode=mmap_mode)
+                  for name in names}
+
+        return arrays, metadata
+
+    import h5py
+
+    f = h5py.File(output, 'r')
+    metadata = json.loads(f.attrs['metadata'])
+    arrays = {name: f[name] for name in f}
+
+    return arrays, metadata
+
+
+def _save_npy(output, arrays, metadata):
+
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    for name, array in arrays.items():
+        _atomic_write(os.path.join(output, name + '.npy'),
+                      lambda f, array=array: np.save(f, np.asarray(array)))
+
+    # metadata is written last, and marks the store as complete
+    _atomic_write(os.path.join(output, 'metadata.json'),
+                  lambda f: f.write(json.dumps(metadata, indent=2, sort_keys=True,
+                                               default=str).encode()))
+
+
+def _save_hdf5(output, arrays, metadata):
+
+    import h5py
+
+    temp_output = '%s.%i.tmp' % (output, os.getpid())
+
+    with h5py.File(temp_output, 'w') as f:
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            chunks = None
+            if array.ndim == 2:
+                chunks = (array.shape[0], 1)
+            f.create_dataset(name, data=array, chunks=chunks)
+        f.attrs['metadata'] = json.dumps(metadata, sort_keys=True, default=str)
+
+    os.replace(temp_output, output)
+
+
+def _atomic_write(filename, write):
+
+    temp_filename = '%s.%i.tmp' % (filename, os.getpid())
+
+    with open(temp_filename, 'wb') as f:
+        write(f)
+    os.replace(temp_filename, filename)
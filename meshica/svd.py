@@ -0,0 +1,306 @@
+import logging
+
+import numpy as np
+from scipy.linalg import eigh, qr, svd
+from sklearn.utils import check_random_state
+from sklearn.utils.extmath import randomized_svd, svd_flip
+
+SVD_SOLVERS = ('gram', 'randomized', 'full')
+
+# columns of the long axis cast to float64 at a time when forming Gram matrices
+GRAM_BLOCK_SIZE = 4096
+
+logger = logging.getLogger(__name__)
+
+
+def svd_update(variance, spatial, update, n_components=None):
+
+    """
+    Fold new rows into a truncated singular value decomposition.
+
+    Implements the additive rank update of Brand 2006, so that the cost
+    of adding a block of rows scales with the size of the block and the
+    retained rank, rather than with the full stacked matrix.
+
+     * https://doi.org/10.1016/j.laa.2005.07.021
+
+    Parameters:
+    - - - - -
+    variance: float, array
+        current singular values, shape (k,)
+        if None, the decomposition is initialized from ``update``
+    spatial: float, array
+        current right singular vectors, shape (k, n_features)
+    update: float, array
+        new rows to add, shape (n_samples, n_features)
+    n_components: int
+        number of singular values / vectors to retain
+        default: keep all
+
+    Returns:
+    - - - -
+    variance: float, array
+        updated singular values
+    spatial: float, array
+        updated right singular vectors
+    """
+
+    if variance is None:
+        _, variance, spatial = svd(update, full_matrices=False)
+        return variance[:n_components], spatial[:n_components]
+
+    k = variance.shape[0]
+    t = update.shape[0]
+
+    # split new rows into components inside and orthogonal to current basis
+    projection = np.dot(update, spatial.T)
+    residual = update - np.dot(projection, spatial)
+    Q, R = qr(residual.T, mode='economic')
+
+    K = np.zeros((k+t, k+t), dtype=np.result_type(variance, update))
+    K[:k, :k] = np.diag(variance)
+    K[k:, :k] = projection
+    K[k:, k:] = R.T
+
+    _, variance, rotation = svd(K, full_matrices=False)
+    rotation = rotation[:n_components]
+
+    spatial = np.dot(rotation[:, :k], spatial) + np.dot(rotation[:, k:], Q.T)
+
+    return variance[:n_components], spatial
+
+
+def blocked_randomized_svd(M, n_components, n_oversamples=10, n_iter=3,
+                           block_size=1000, random_state=None, dtype=np.float64):
+
+    """
+    Randomized SVD of a matrix too large to hold in memory.
+
+    Implements the randomized range finder of Halko et al. 2011, reading
+    ``M`` one block of rows at a time, so that ``M`` can be a memory-mapped
+    array.  Each power iteration costs two passes over ``M``; only matrices
+    of size (n_samples x k) and (n_features x k) are held in memory, where
+    k = n_components + n_oversamples.
+
+     * https://doi.org/10.1137/090771806
+
+    Parameters:
+    - - - - -
+    M: float, array
+        matrix to decompose, shape (n_samples, n_features)
+        any object with a ``shape`` and row slicing (e.g. numpy.memmap)
+    n_components: int
+        number of singular values / vectors to compute
+    n_oversamples: int
+        additional random vectors used to sample the range of M
+    n_iter: int
+        number of power iterations
+    block_size: int
+        number of rows of M read at a time
+    random_state: int, or RandomState
+        random number generator
+    dtype: numpy dtype
+        floating point precision of the projections
+
+    Returns:
+    - - - -
+    U: float, array
+        left singular vectors, shape (n_samples, n_components)
+    S: float, array
+        singular values, shape (n_components,)
+    Vt: float, array
+        right singular vectors, shape (n_components, n_features)
+    """
+
+    random_state = check_random_state(random_state)
+
+    n_samples, n_features = M.shape
+    n_random = min(n_components + n_oversamples, n_samples, n_features)
+    blocks = [slice(start, min(start+block_size, n_samples))
+              for start in range(0, n_samples, block_size)]
+
+    def project(Z):
+        # M * Z
+        Y = np.empty((n_samples, Z.shape[1]), dtype=dtype)
+        for block in blocks:
+            Y[block] = np.dot(M[block], Z)
+        return Y
+
+    def back_project(Y):
+        # M.T * Y
+        Z = np.zeros((n_features, Y.shape[1]), dtype=dtype)
+        for block in blocks:
+            Z += np.dot(M[block].T, Y[block])
+        return Z
+
+    Q = project(random_state.normal(size=(n_features, n_random)).astype(dtype))
+
+    for _ in range(n_iter):
+        Q, _ = qr(Q, mode='economic')
+        Z, _ = qr(back_project(Q), mode='economic')
+        Q = project(Z)
+
+    Q, _ = qr(Q, mode='economic')
+
+    # B = Q.T * M
+    B = back_project(Q).T
+    Ub, S, Vt = svd(B, full_matrices=False)
+    U = np.dot(Q, Ub)
+
+    U, Vt = svd_flip(U, Vt)
+
+    return U[:, :n_components], S[:n_components], Vt[:n_components]
+
+
+def svd_costs(n_samples, n_features, n_components, n_oversamples=10, n_iter=3):
+
+    """
+    Estimate the cost of each truncated SVD solver, in multiply-adds.
+
+    'gram' forms the smaller of the two Gram matrices, takes its top
+    eigenvectors, and projects the matrix onto them.  'randomized' makes
+    2*n_iter + 2 passes of products with (n_components + n_oversamples)
+    vectors.  'full' is a dense economy SVD.
+
+    Parameters:
+    - - - - -
+    n_samples, n_features: int
+        shape of the matrix
+    n_components: int
+        number of singular values / vectors to compute
+    n_oversamples, n_iter: int
+        parameters of the randomized solver
+
+    Returns:
+    - - - -
+    costs: dict
+        estimated cost of each solver
+    """
+
+    small = min(n_samples, n_features)
+    large = max(n_samples, n_features)
+    n_random = min(n_components + n_oversamples, small)
+
+    return {'gram': small**2 * large / 2. + 4. * small**3 / 3. + small * large * n_components,
+            'randomized': (2. * n_iter + 2.) * small * large * n_random,
+            'full': 4. * small**2 * large + 8. * small**3}
+
+
+def select_svd_solver(n_samples, n_features, n_components, n_oversamples=10, n_iter=3):
+
+    """
+    Pick the cheapest truncated SVD solver for a matrix shape and rank.
+
+    Returns:
+    - - - -
+    solver: str
+        'gram', 'randomized' or 'full'
+    costs: dict
+        estimated cost of each solver, in multiply-adds
+    """
+
+    costs = svd_costs(n_samples, n_features, n_components, n_oversamples, n_iter)
+    solver = min(SVD_SOLVERS, key=costs.get)
+
+    return solver, costs
+
+
+def truncated_svd(M, n_components, solver='auto', n_oversamples=10, n_iter=3,
+                  random_state=None):
+
+    """
+    Truncated SVD with an automatically selected solver.
+
+    When one side of the matrix is much smaller than the other (e.g. a
+    subject's timepoints compared to its vertices), eigendecomposing the
+    small Gram matrix and projecting back gives exact singular vectors,
+    and is often cheaper than randomized methods.  With solver='auto',
+    the solver with the lowest estimated cost is used, and the choice is
+    logged.
+
+    Parameters:
+    - - - - -
+    M: float, array
+        matrix to decompose, shape (n_samples, n_features)
+    n_components: int
+        number of singular values / vectors to compute
+    solver: str
+        'auto', 'gram', 'randomized' or 'full'
+    n_oversamples, n_iter: int
+        parameters of the randomized solver
+    random_state: int, or RandomState
+        random number generator of the randomized solver
+
+    Returns:
+    - - - -
+    U: float, array
+        left singular vectors, shape (n_samples, n_components)
+    S: float, array
+        singular values, shape (n_components,)
+    Vt: float, array
+        right singular vectors, shape (n_components, n_features)
+    """
+
+    n_samples, n_features = M.shape
+    n_components = min(n_components, n_samples, n_features)
+    solver_, costs = select_svd_solver(n_samples, n_features, n_components,
+                                       n_oversamples, n_iter)
+
+    if solver == 'auto':
+        solver = solver_
+    elif solver not in SVD_SOLVERS:
+        raise ValueError("solver must be 'auto', 'gram', 'randomized' or 'full'. "
+                         "You provided %s." % str(solver))
+
+    logger.info('SVD of %i x %i matrix, %i components: %s solver (estimated %.2e '
+                'multiply-adds)', n_samples, n_features, n_components, solver, costs[solver])
+
+    if solver == 'randomized':
+        return randomized_svd(M, n_components, n_oversamples=n_oversamples,
+                              n_iter=n_iter, random_state=random_state)
+
+    if solver == 'full':
+        U, S, Vt = svd(M, full_matrices=False)
+        U, Vt = svd_flip(U[:, :n_components], Vt[:n_components])
+        return U, S[:n_components], Vt
+
+    U, S, Vt = _gram_svd(M, n_components)
+    U, Vt = svd_flip(U, Vt)
+
+    return U, S, Vt
+
+
+def _gram_svd(M, n_components):
+
+    """
+    Truncated SVD from the top eigenvectors of the smaller Gram matrix.
+    The Gram matrix is accumulated, and eigendecomposed, in float64; the
+    long axis is cast one block at a time, so float32 inputs are not
+    copied whole.
+    """
+
+    n_samples, n_features = M.shape
+    transpose = n_samples > n_features
+    if transpose:
+        M = M.T
+
+    n_small, n_large = M.shape
+    gram = np.zeros((n_small, n_small))
+    for start in range(0, n_large, GRAM_BLOCK_SIZE):
+        block = M[:, start:start+GRAM_BLOCK_SIZE].astype(np.float64, copy=False)
+        gram += np.dot(block, block.T)
+    eigenvalues, U = eigh(gram, subset_by_index=[n_small-n_components, n_small-1])
+
+    # eigh returns eigenvalues in increasing order
+    eigenvalues = eigenvalues[::-1]
+    U = U[:, ::-1]
+
+    S = np.sqrt(np.clip(eigenvalues, 0, None))
+    scale = np.where(S > 0, S, 1)
+    U = U.astype(M.dtype, copy=False)
+    Vt = np.dot(U.T, M) / scale[:, np.newaxis].astype(M.dtype)
+    S = S.astype(M.dtype)
+
+    if transpose:
+        return Vt.T, S, U.T
+    return U, S, Vt
@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+
+from meshica.cache import SubjectCache
+
+
+def test_cache_roundtrip_and_eviction(tmpdir):
+    "Check that entries are keyed by content and parameters, and evicted by budget."
+    cache = SubjectCache(str(tmpdir.join('cache')), max_bytes=1500)
+    rng = np.random.RandomState(0)
+
+    source = str(tmpdir.join('subject.npy'))
+    np.save(source, rng.randn(20, 10))
+
+    key = cache.key(source, standardize=True, t_r=0.72)
+    assert cache.key(source, standardize=True, t_r=0.72) == key
+    assert cache.key(source, standardize=False, t_r=0.72) != key
+    assert cache.get(key) is None
+
+    signals = rng.randn(20, 10)
+    stored = cache.put(key, signals)
+    assert stored.dtype == np.float32
+    np.testing.assert_allclose(cache.get(key), signals, rtol=1e-6)
+
+    # a second, newer entry pushes the cache over budget
+    os.utime(cache._entry(key), (0, 0))
+    other = cache.key(signals, standardize=True)
+    cache.put(other, rng.randn(20, 10))
+    assert cache.get(key) is None
+    assert cache.get(other) is not None
+    assert len(os.listdir(cache.location)) == 1
+
+
+def test_cache_key_includes_cleaning_version(tmpdir, monkeypatch):
+    "Check that entries cleaned by another version of the cleaning kernel are not reused."
+    cache = SubjectCache(str(tmpdir.join('cache')))
+    signals = np.random.RandomState(0).randn(20, 10)
+
+    key = cache.key(signals, standardize=True)
+    monkeypatch.setattr('meshica.cache.CLEANING_VERSION', -1)
+    assert cache.key(signals, standardize=True) != key
@@ -0,0 +1,105 @@
+import json
+
+import numpy as np
+import pytest
+
+from meshica.canica import CanICA
+from meshica.instrumentation import FitStats
+
+
+def _subjects(tmpdir, n_subjects, n_vertices=200, n_timepoints=40):
+
+    rng = np.random.RandomState(0)
+
+    files = []
+    for s in range(n_subjects):
+        matrix = rng.randn(n_vertices, n_timepoints)
+        matrix[s*5:(s+1)*5] = 0
+        filename = str(tmpdir.join('subject_%i.npy' % (s)))
+        np.save(filename, matrix)
+        files.append(filename)
+
+    return files
+
+
+def _merge(files, **params):
+
+    model = CanICA(n_components=5, svd_solver='full', **params)
+    model.fit_stats_ = FitStats()
+    signals = model._merge_and_reduce(files)
+
+    return np.asarray(signals), model
+
+
+@pytest.mark.parametrize('pca_filter', [False, True])
+@pytest.mark.parametrize('memmap', [False, True])
+def test_streaming_matches_in_memory_concatenation(tmpdir, pca_filter, memmap):
+    "Check that streaming concatenation gives the same group matrix and mask."
+    files = _subjects(tmpdir, 3)
+
+    expected, model = _merge(files, pca_filter=pca_filter)
+    streamed, streaming = _merge(files, pca_filter=pca_filter, streaming=True,
+                                 memmap=str(tmpdir.join('group.npy')) if memmap else None)
+
+    np.testing.assert_array_equal(streaming.mask, model.mask)
+    np.testing.assert_allclose(streamed, expected, atol=1e-12)
+
+
+def test_parallel_preparation_matches_serial(tmpdir):
+    "Check that subjects prepared by worker processes match serial preparation, in input order."
+    files = _subjects(tmpdir, 4)
+    bad = np.load(files[1])
+    bad[10, 0] = np.inf
+    np.save(files[1], bad)
+
+    manifests = [str(tmpdir.join('serial.json')), str(tmpdir.join('parallel.json'))]
+    serial, model = _merge(files, quarantine=manifests[0])
+    parallel, workers = _merge(files, quarantine=manifests[1], n_workers=2)
+
+    np.testing.assert_array_equal(workers.mask, model.mask)
+    np.testing.assert_array_equal(parallel, serial)
+
+    quarantined = []
+    for manifest in manifests:
+        with open(manifest, 'r') as f:
+            quarantined.append(json.load(f))
+    assert quarantined[0] == quarantined[1]
+    assert list(quarantined[1]) == [files[1]]
+
+
+def test_cached_rejection_is_quarantined(tmpdir):
+    "Check that a subject rejected from its cached zero counts is still quarantined."
+    files = _subjects(tmpdir, 3, n_vertices=3200, n_timepoints=20)
+    empty = np.load(files[0])
+    empty[:3100] = 0
+    np.save(files[0], empty)
+
+    cache = str(tmpdir.join('cache'))
+    manifests = [str(tmpdir.join('cold.json')), str(tmpdir.join('warm.json'))]
+    for manifest in manifests:
+        _merge(files, cache=cache, quarantine=manifest)
+
+        with open(manifest, 'r') as f:
+            quarantined = json.load(f)
+        assert list(quarantined) == [files[0]]
+        assert quarantined[files[0]]['zero_rows'] == 3100
+        assert quarantined[files[0]]['reason'] == 'too many all-zero vertices'
+
+
+def test_float32_fit_is_finite(tmpdir):
+    "Check that a float32 fit, whose FastICA iterations diverge in float32, gives finite components."
+    rng = np.random.RandomState(0)
+    files = []
+    for s in range(6):
+        matrix = rng.randn(500, 120)
+        matrix[:3] = 0
+        filename = str(tmpdir.join('subject_%i.npy' % (s)))
+        np.save(filename, matrix)
+        files.append(filename)
+
+    model = CanICA(n_components=5, n_init=2, n_jobs=1, random_state=1, dtype=np.float32,
+                   low_pass=0.1, t_r=0.72)
+    model.fit(files)
+
+    assert model.components_.dtype == np.float32
+    assert np.isfinite(model.components_).all()
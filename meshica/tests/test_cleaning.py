@@ -0,0 +1,66 @@
+import tracemalloc
+import warnings
+
+import numpy as np
+from nilearn.signal import clean
+from scipy import signal as sp_signal
+
+from meshica.cleaning import butterworth_sos, clean_signals, filter_plan
+
+
+def test_clean_signals_matches_nilearn():
+    "Check the in-place cleaning kernel against nilearn.signal.clean."
+    rng = np.random.RandomState(0)
+    signals = rng.randn(200, 300) + np.linspace(0, 3, 200)[:, np.newaxis]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        expected = clean(signals.copy(), standardize=True, low_pass=0.1,
+                         high_pass=0.01, t_r=0.72)
+
+    cleaned = signals.astype(np.float32)
+    result = clean_signals(cleaned, standardize=True, low_pass=0.1,
+                           high_pass=0.01, t_r=0.72, chunk_size=64)
+
+    assert result is cleaned
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, expected, atol=1e-4)
+
+
+def test_filter_plan_matches_sosfiltfilt():
+    "Check cached filter plans against scipy's sosfiltfilt."
+    rng = np.random.RandomState(0)
+    signals = rng.randn(200, 30)
+
+    plan = filter_plan(0.1, 0.01, 0.72, 200)
+    expected = sp_signal.sosfiltfilt(butterworth_sos(0.1, 0.01, 0.72), signals,
+                                     axis=0, padtype='odd')
+
+    assert filter_plan(0.1, 0.01, 0.72, 200) is plan
+    np.testing.assert_allclose(plan.apply(signals), expected, atol=1e-10)
+
+
+def test_clean_signals_memory_is_bounded_by_block_bytes():
+    "Check peak memory of cleaning (vertices x timepoints) matrices, as the estimators pass them."
+    rng = np.random.RandomState(0)
+    signals = rng.randn(20000, 100).astype(np.float32)
+    block_bytes = 2**20
+
+    tracemalloc.start()
+    clean_signals(signals, low_pass=0.1, high_pass=0.01, t_r=0.72, block_bytes=block_bytes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert peak < 8 * block_bytes
+
+
+def test_fft_filter_plan_matches_sosfiltfilt_away_from_edges():
+    "Check the frequency-domain filter plan against sosfiltfilt for a low-pass filter."
+    rng = np.random.RandomState(0)
+    signals = rng.randn(400, 30)
+
+    plan = filter_plan(0.1, None, 0.72, 400, 5, 'fft')
+    expected = sp_signal.sosfiltfilt(butterworth_sos(0.1, None, 0.72), signals,
+                                     axis=0, padtype='odd')
+
+    np.testing.assert_allclose(plan.apply(signals)[50:-50], expected[50:-50], atol=1e-3)
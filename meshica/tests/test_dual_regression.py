@@ -0,0 +1,46 @@
+import numpy as np
+from sklearn.linear_model import LinearRegression
+
+from meshica.dual_regression import Regressor
+from meshica.masking import VertexMask
+
+
+def _subject(n_vertices=300, n_timepoints=40, n_components=5):
+
+    rng = np.random.RandomState(0)
+    components = rng.randn(n_vertices, n_components)
+    signals = np.dot(components, rng.randn(n_components, n_timepoints)) + rng.randn(n_vertices, n_timepoints)
+
+    return signals, components
+
+
+def test_precomputed_temporal_regression_matches_linear_regression():
+    "Check the cached pseudo-inverse against LinearRegression, and its invalidation."
+    signals, components = _subject()
+    regressor = Regressor(hdr_alpha=None, precompute=True)
+
+    expected = LinearRegression().fit(components, signals).coef_
+    np.testing.assert_allclose(regressor.temporal_regression(signals, components), expected, atol=1e-10)
+
+    components *= 2
+    expected = LinearRegression().fit(components, signals).coef_
+    np.testing.assert_allclose(regressor.temporal_regression(signals, components), expected, atol=1e-10)
+
+
+def test_chunked_regression_of_memory_map_matches_full_regression(tmpdir):
+    "Check chunked regressions of a masked memory-mapped subject against the in-memory fit."
+    signals, components = _subject()
+    mask = VertexMask(np.arange(signals.shape[0]) % 7 != 0)
+
+    filename = str(tmpdir.join('rest.npy'))
+    np.save(filename, signals)
+    rest = np.load(filename, mmap_mode='r')
+
+    expected = Regressor(hdr_alpha=None)
+    expected.fit(mask.apply(signals), mask.apply(components))
+
+    chunked = Regressor(hdr_alpha=None, precompute=True, chunk_size=64)
+    chunked.fit(mask.view(rest), mask.apply(components))
+
+    np.testing.assert_allclose(chunked.temporal_, expected.temporal_, atol=1e-10)
+    np.testing.assert_allclose(chunked.spatial_, expected.spatial_, atol=1e-8)
@@ -0,0 +1,17 @@
+import numpy as np
+
+from meshica.ica import ICA
+
+
+def test_float32_fit_is_finite(tmpdir):
+    "Check that a float32 single-subject fit gives finite float32 components."
+    rng = np.random.RandomState(0)
+    filename = str(tmpdir.join('subject.npy'))
+    np.save(filename, np.dot(rng.laplace(size=(500, 5)), rng.randn(5, 120)) + rng.randn(500, 120))
+
+    model = ICA(n_components=5, n_init=2, n_jobs=1, random_state=1, dtype=np.float32,
+                low_pass=0.1, t_r=0.72)
+    model.fit(filename)
+
+    assert model.components_.dtype == np.float32
+    assert np.isfinite(model.components_).all()
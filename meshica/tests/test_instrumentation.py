@@ -0,0 +1,66 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+
+from meshica.instrumentation import FitStats, peak_rss
+
+
+def test_fit_stats_records_and_log(tmpdir):
+    "Check stage records, their summary and the JSON lines log."
+    log = str(tmpdir.join('stats.jsonl'))
+    stats = FitStats(log)
+
+    for subject in ['a', 'b']:
+        with stats.stage('load', subject):
+            sum(range(1000))
+    with stats.stage('fastica'):
+        pass
+
+    summary = stats.summary()
+    assert summary['load']['count'] == 2
+    assert summary['fastica']['count'] == 1
+    assert summary['load']['wall_time'] >= 0
+
+    with open(log, 'r') as f:
+        records = [json.loads(line) for line in f]
+    assert [r['stage'] for r in records] == ['load', 'load', 'fastica']
+    assert records[1]['subject'] == 'b'
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='per-stage peaks need /proc')
+def test_fit_stats_peak_rss_is_per_stage():
+    "Check that a stage after the process peak reports its own, lower peak."
+    stats = FitStats()
+
+    with stats.stage('allocate'):
+        array = np.ones(2**25)
+        array.sum()
+    del array
+    with stats.stage('idle'):
+        pass
+
+    allocate, idle = [record['peak_rss'] for record in stats.records]
+    assert idle < allocate - 2**27
+    assert peak_rss() >= allocate
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='per-stage peaks need /proc')
+def test_fit_stats_nested_stages_keep_outer_peak():
+    "Check that a nested stage does not reset the peak of the stage enclosing it."
+    stats = FitStats()
+
+    with stats.stage('outer'):
+        with stats.stage('inner'):
+            array = np.ones(2**25)
+            array.sum()
+        del array
+        with stats.stage('after'):
+            pass
+    with stats.stage('idle'):
+        pass
+
+    inner, after, outer, idle = stats.records
+    assert inner['peak_rss'] is None and after['peak_rss'] is None
+    assert outer['peak_rss'] > idle['peak_rss'] + 2**27
@@ -0,0 +1,20 @@
+import numpy as np
+
+from meshica.loading import as_array, load
+from meshica.masking import VertexMask
+
+
+def test_load_memory_maps_npy(tmpdir):
+    "Check that .npy subjects are memory mapped and masked lazily."
+    rng = np.random.RandomState(0)
+    matrix = rng.randn(40, 10)
+    filename = str(tmpdir.join('subject.npy'))
+    np.save(filename, matrix)
+
+    subject = load(filename)
+    assert isinstance(subject, np.memmap)
+
+    mask = VertexMask(rng.rand(40) > 0.5)
+    masked = as_array(mask.apply(subject), np.float32)
+    assert masked.dtype == np.float32
+    np.testing.assert_allclose(masked, mask.apply(matrix), rtol=1e-6)
@@ -0,0 +1,18 @@
+import numpy as np
+
+from meshica.masking import VertexMask
+
+
+def test_vertex_mask_round_trip():
+    "Check gathering and scattering with a precomputed mask index."
+    rng = np.random.RandomState(0)
+    mask = rng.rand(50, 1) > 0.3
+    matrix = rng.randn(50, 8)
+
+    vertex_mask = VertexMask(mask)
+    masked = vertex_mask.apply(matrix)
+    np.testing.assert_array_equal(masked, matrix[mask[:, 0]])
+
+    full = vertex_mask.scatter(masked)
+    np.testing.assert_array_equal(full[mask[:, 0]], matrix[mask[:, 0]])
+    assert not full[~mask[:, 0]].any()
@@ -0,0 +1,155 @@
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+from meshica.instrumentation import FitStats
+from meshica.migp import MIGP
+
+
+def _subjects(tmpdir, n_subjects, n_vertices=200, n_timepoints=50):
+
+    rng = np.random.RandomState(0)
+    sources = rng.laplace(size=(n_vertices, 3))
+
+    files = []
+    for s in range(n_subjects):
+        filename = str(tmpdir.join('subject_%i.npy' % (s)))
+        np.save(filename, np.dot(sources, rng.randn(3, n_timepoints)) + rng.randn(n_vertices, n_timepoints))
+        files.append(filename)
+
+    return files
+
+
+class _Interrupted(MIGP):
+
+    def _load_subject(self, temp_file):
+        self.n_loaded = getattr(self, 'n_loaded', 0) + 1
+        if self.n_loaded > 4:
+            raise KeyboardInterrupt
+        return super(_Interrupted, self)._load_subject(temp_file)
+
+
+def test_resumed_fit_matches_uninterrupted_fit(tmpdir):
+    "Check that a fit interrupted and resumed from its checkpoint matches an uninterrupted fit."
+    files = _subjects(tmpdir, 6)
+    checkpoint = str(tmpdir.join('checkpoint.npz'))
+    params = dict(n_components=3, m_eigen=20, s_init=2, n_init=2, n_jobs=1, random_state=0)
+
+    expected = MIGP(**params)
+    expected.fit(files)
+
+    with pytest.raises(KeyboardInterrupt):
+        _Interrupted(checkpoint=checkpoint, checkpoint_every=1, **params).fit(files)
+
+    resumed = MIGP(checkpoint=checkpoint, **params)
+    resumed.fit(files, resume=checkpoint)
+
+    np.testing.assert_array_equal(resumed.variance_, expected.variance_)
+    np.testing.assert_array_equal(resumed.spatial_, expected.spatial_)
+    np.testing.assert_array_equal(resumed.components_, expected.components_)
+
+
+def test_partial_fit_folds_arrays_and_files(tmpdir):
+    "Check that partial_fit accepts arrays and files, and unmixes on demand."
+    rng = np.random.RandomState(0)
+    subjects = [np.dot(rng.laplace(size=(200, 3)), rng.randn(3, 50)) + rng.randn(200, 50)
+                for _ in range(3)]
+
+    filename = str(tmpdir.join('subject.npy'))
+    np.save(filename, subjects[2])
+    original = subjects[0].copy()
+
+    model = MIGP(n_components=3, m_eigen=20, s_init=2, n_init=2, n_jobs=1, random_state=0)
+
+    model.partial_fit(subjects[0])
+    assert not hasattr(model, 'spatial_')
+    model.partial_fit([subjects[1], filename])
+
+    assert model.n_subjects_ == 3
+    assert model.spatial_.shape == (20, 200)
+    np.testing.assert_array_equal(subjects[0], original)
+
+    components = model.components_
+    assert components.shape == (200, 3)
+    assert model.components_ is components
+
+
+class _SerialExecutor(object):
+
+    def __init__(self):
+        self.n_submitted = 0
+
+    def submit(self, function, *args, **kwargs):
+        self.n_submitted += 1
+        future = Future()
+        future.set_result(function(*args, **kwargs))
+        return future
+
+
+def _subspace_overlap(first, second, n_components):
+
+    U = np.linalg.svd(first[:n_components].T, full_matrices=False)[0]
+    V = np.linalg.svd(second[:n_components].T, full_matrices=False)[0]
+
+    return np.linalg.svd(np.dot(U.T, V), compute_uv=False).min()
+
+
+@pytest.mark.parametrize('executor', [None, _SerialExecutor()])
+def test_parallel_fit_matches_serial_fit(tmpdir, executor):
+    "Check that partitioned MIGP recovers the serial basis, quarantine and stage records."
+    files = _subjects(tmpdir, 6)
+    bad = np.load(files[3])
+    bad[0, 0] = np.nan
+    np.save(files[3], bad)
+
+    params = dict(n_components=3, m_eigen=20, s_init=2, n_init=2, n_jobs=1, random_state=0)
+
+    serial = MIGP(quarantine=str(tmpdir.join('serial.json')), **params)
+    serial._random_state = np.random.RandomState(0)
+    serial.fit_stats_ = FitStats()
+    serial._raw_fit(files)
+
+    parallel = MIGP(n_workers=2, executor=executor,
+                    quarantine=str(tmpdir.join('parallel.json')), **params)
+    parallel.fit(files)
+
+    if executor is not None:
+        assert executor.n_submitted == 3
+
+    assert _subspace_overlap(parallel.spatial_, serial.spatial_, 3) > 0.99
+    np.testing.assert_allclose(parallel.variance_[:3], serial.variance_[:3], rtol=0.05)
+
+    assert set(parallel._quarantine.subjects) == set(serial._quarantine.subjects) == {files[3]}
+
+    def loaded(model):
+        return sorted(r['subject'] for r in model.fit_stats_.records if r['stage'] == 'clean')
+    assert loaded(parallel) == loaded(serial)
+    assert 'merge' in parallel.fit_stats_.summary()
+
+
+def test_parallel_fit_rejects_checkpoint(tmpdir):
+    "Check that checkpointing is refused rather than silently skipped by partitioned MIGP."
+    files = _subjects(tmpdir, 4)
+    model = MIGP(n_workers=2, checkpoint=str(tmpdir.join('checkpoint.npz')))
+
+    with pytest.raises(ValueError):
+        model.fit(files)
+
+
+def test_cached_subjects_keep_fit_precision(tmpdir):
+    "Check that a float64 fit from cached subjects stays in float64 and matches an uncached fit."
+    files = _subjects(tmpdir, 4)
+    params = dict(n_components=3, m_eigen=20, s_init=2, n_init=2, n_jobs=1, random_state=0,
+                  dtype=np.float64)
+
+    expected = MIGP(**params)
+    expected.fit(files)
+
+    cache = str(tmpdir.join('cache'))
+    for _ in range(2):
+        cached = MIGP(cache=cache, **params)
+        cached.fit(files)
+
+        assert cached._load_subject(files[0]).dtype == np.float64
+        np.testing.assert_array_equal(cached.spatial_, expected.spatial_)
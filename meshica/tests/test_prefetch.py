@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+from meshica.prefetch import prefetch
+
+
+class _Recorder(object):
+
+    def __init__(self, fail=None):
+        self.started = []
+        self.fail = fail
+        self._lock = threading.Lock()
+
+    def __call__(self, item):
+        with self._lock:
+            self.started.append(item)
+        # later items finish first, so ordering is not incidental
+        time.sleep(0.01 * (5 - item % 5))
+        if item == self.fail:
+            raise RuntimeError('failed on %i' % (item))
+        return item * 2
+
+
+@pytest.mark.parametrize('depth', [0, 1, 3])
+def test_prefetch_preserves_order(depth):
+    "Check that results are yielded in input order, whatever the depth."
+    results = list(prefetch(_Recorder(), range(10), depth=depth))
+    assert results == [(item, item * 2) for item in range(10)]
+
+
+def test_prefetch_bounds_pending_items():
+    "Check that at most depth items are computed ahead of the caller."
+    recorder = _Recorder()
+    subjects = prefetch(recorder, range(10), depth=2)
+
+    assert next(subjects) == (0, 0)
+    time.sleep(0.1)
+    assert sorted(recorder.started) == [0, 1, 2]
+    subjects.close()
+
+
+def test_prefetch_propagates_errors_and_cancels_pending():
+    "Check that a background failure is raised to the caller and later items are not run."
+    recorder = _Recorder(fail=1)
+    subjects = prefetch(recorder, range(10), depth=2)
+
+    assert next(subjects) == (0, 0)
+    with pytest.raises(RuntimeError, match='failed on 1'):
+        next(subjects)
+
+    time.sleep(0.1)
+    assert max(recorder.started) <= 3
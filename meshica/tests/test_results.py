@@ -0,0 +1,24 @@
+import numpy as np
+
+from meshica.masking import VertexMask
+from meshica.results import load_results, save_results
+
+
+def test_npy_store_round_trip(tmpdir):
+    "Check that stored maps are memory mapped with their mask and metadata."
+    rng = np.random.RandomState(0)
+    mask = VertexMask(rng.rand(30) > 0.5)
+    spatial = rng.randn(mask.n_kept, 4)
+    temporal = rng.randn(50, 4)
+
+    output = str(tmpdir.join('subject'))
+    save_results(output, {'spatial': spatial, 'temporal': temporal}, mask=mask,
+                 metadata={'tr': 0.72})
+
+    arrays, metadata = load_results(output)
+    assert isinstance(arrays['spatial'], np.memmap)
+    np.testing.assert_array_equal(arrays['spatial'][:, 2], spatial[:, 2])
+    np.testing.assert_array_equal(arrays['temporal'], temporal)
+    np.testing.assert_array_equal(arrays['mask_index'], mask.index)
+    assert metadata['tr'] == 0.72
+    assert metadata['n_vertices'] == 30
@@ -0,0 +1,59 @@
+import numpy as np
+from sklearn.utils.extmath import randomized_svd
+
+from meshica.svd import blocked_randomized_svd, svd_update, truncated_svd
+
+
+def test_svd_update_matches_full_svd():
+    "Check that incremental updates recover the SVD of the stacked matrix."
+    rng = np.random.RandomState(0)
+    A = rng.randn(30, 200)
+    B = rng.randn(20, 200)
+
+    variance, spatial = svd_update(None, None, A)
+    variance, spatial = svd_update(variance, spatial, B, 40)
+
+    expected = np.linalg.svd(np.vstack([A, B]), compute_uv=False)
+    np.testing.assert_allclose(variance, expected[:40])
+    np.testing.assert_allclose(np.dot(spatial, spatial.T), np.eye(40), atol=1e-10)
+
+
+def test_blocked_randomized_svd_matches_randomized_svd(tmpdir):
+    "Check that the blocked SVD of a memory-mapped matrix matches randomized_svd."
+    rng = np.random.RandomState(0)
+    A = np.dot(rng.randn(500, 20), rng.randn(20, 100)) + 0.1*rng.randn(500, 100)
+
+    source = str(tmpdir.join('A.npy'))
+    np.save(source, A)
+    M = np.load(source, mmap_mode='r')
+
+    U, S, Vt = blocked_randomized_svd(M, 10, block_size=64, random_state=0)
+    U_ref, S_ref, Vt_ref = randomized_svd(A, 10, n_iter=3, random_state=0)
+
+    np.testing.assert_allclose(S, S_ref, rtol=1e-8)
+    np.testing.assert_allclose(np.dot(U*S, Vt), np.dot(U_ref*S_ref, Vt_ref), atol=1e-8)
+
+
+def test_gram_svd_matches_full_svd():
+    "Check that the Gram solver gives exact singular vectors for both orientations."
+    rng = np.random.RandomState(0)
+    A = rng.randn(40, 600)
+
+    for M in [A, A.T]:
+        U, S, Vt = truncated_svd(M, 8, solver='gram')
+        U_ref, S_ref, Vt_ref = truncated_svd(M, 8, solver='full')
+
+        np.testing.assert_allclose(S, S_ref, rtol=1e-10)
+        np.testing.assert_allclose(np.dot(U*S, Vt), np.dot(U_ref*S_ref, Vt_ref), atol=1e-10)
+
+
+def test_gram_svd_of_float32_accumulates_in_float64():
+    "Check that the Gram solver of a float32 matrix matches the float64 singular values."
+    rng = np.random.RandomState(0)
+    A = np.dot(rng.randn(10000, 5), rng.randn(5, 30)) + 100.
+
+    _, S, _ = truncated_svd(A.astype(np.float32), 5, solver='gram')
+    expected = np.linalg.svd(A.astype(np.float32).astype(np.float64), compute_uv=False)[:5]
+
+    assert S.dtype == np.float32
+    np.testing.assert_allclose(S, expected, rtol=1e-5)
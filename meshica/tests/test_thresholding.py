@@ -0,0 +1,26 @@
+import numpy as np
+
+from meshica.thresholding import component_bounds
+
+
+def test_component_bounds():
+    "Check exact and approximate per-component bounds."
+    rng = np.random.RandomState(0)
+    X = np.column_stack([rng.randn(20000), 3 + 2*rng.randn(20000), rng.gamma(2, size=20000)])
+
+    lower, upper, error = component_bounds(X, 0.05, method='percentile')
+    np.testing.assert_allclose(lower[:2], [-1.96, 3 - 2*1.96], atol=0.1)
+    np.testing.assert_allclose(upper[:2], [1.96, 3 + 2*1.96], atol=0.1)
+    assert np.all(error == 0)
+
+    approx_lower, approx_upper, error = component_bounds(X, 0.05, method='percentile',
+                                                         approximate=True, n_bins=500)
+    assert np.all(np.abs(approx_lower - lower) <= error)
+    assert np.all(np.abs(approx_upper - upper) <= error)
+
+    lower, upper, _ = component_bounds(X, 0.05, method='hpd')
+    approx_lower, approx_upper, error = component_bounds(X, 0.05, method='hpd',
+                                                         approximate=True, n_bins=500)
+    coverage = np.mean((X >= approx_lower) & (X <= approx_upper), axis=0)
+    assert np.all(coverage >= 0.95)
+    assert np.all((approx_upper - approx_lower) - (upper - lower) <= error)
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from sklearn.decomposition import fastica
+
+from meshica.unmixing import fastica_restarts, whiten
+
+
+def test_shared_whitening_matches_fastica_whitening():
+    "Check that FastICA on pre-whitened data reproduces whitened FastICA, up to sign, scale and order."
+    rng = np.random.RandomState(0)
+    X = np.dot(rng.laplace(size=(500, 4)), rng.randn(4, 4)) + 3.
+
+    X_white = whiten(X)
+
+    for seed in [0, 1]:
+        _, _, expected = fastica(X, whiten='arbitrary-variance', fun='cube',
+                                 random_state=seed)
+        _, _, shared = fastica(X_white, whiten=False, fun='cube', random_state=seed)
+
+        correlation = np.abs(np.corrcoef(expected.T, shared.T)[:4, 4:])
+        np.testing.assert_allclose(correlation.max(1), 1, atol=1e-5)
+        np.testing.assert_allclose(correlation.max(0), 1, atol=1e-5)
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_fastica_restarts_keeps_sparsest_restart(n_jobs):
+    "Check restart seeding and selection, serially and with memory-mapped parallel restarts."
+    rng = np.random.RandomState(0)
+    X = np.dot(rng.laplace(size=(2000, 4)), rng.randn(4, 4))
+
+    seeds = np.random.RandomState(0).randint(np.iinfo(np.int32).max, size=3)
+    restarts = [fastica(whiten(X), whiten=False, fun='cube', random_state=seed)[2].T
+                for seed in seeds]
+    expected = min(restarts, key=lambda ica_map: np.sum(np.abs(ica_map), axis=1).max())
+
+    ica_maps = fastica_restarts(X, n_init=3, random_state=0, n_jobs=n_jobs,
+                                backend='loky' if n_jobs > 1 else None)
+
+    np.testing.assert_allclose(ica_maps, expected, atol=1e-10)
@@ -0,0 +1,29 @@
+import numpy as np
+
+from meshica.validation import Quarantine, screen
+
+
+def test_screen_and_quarantine(tmpdir):
+    "Check single-pass screening and the quarantine manifest."
+    rng = np.random.RandomState(0)
+    matrix = rng.randn(100, 20)
+    matrix[:10] = 0
+    matrix[50, 3] = np.nan
+    matrix[60, 4] = np.inf
+
+    report, zeros = screen(matrix, chunk_size=7)
+    assert report['nans'] == 1
+    assert report['infs'] == 1
+    assert report['zero_rows'] == 10
+    assert zeros[:10].all() and not zeros[10:].any()
+
+    finite = matrix[np.isfinite(matrix)]
+    np.testing.assert_allclose(report['mean'], finite.mean())
+    np.testing.assert_allclose(report['std'], finite.std())
+
+    manifest = str(tmpdir.join('quarantine.json'))
+    quarantine = Quarantine(manifest)
+    quarantine.add('subject.npy', report, 'non-finite values')
+    quarantine.save()
+
+    assert 'subject.npy' in Quarantine(manifest)
@@ -0,0 +1,127 @@
+import numpy as np
+
+
+def component_bounds(X, alpha=0.05, method='hpd', approximate=False, n_bins=1000):
+
+    """
+    Compute per-component confidence bounds of coefficient maps.
+
+    Bounds of all components are computed at once.  Exact bounds sort
+    each component; approximate bounds use a single histogram pass over
+    the data.  Approximate percentile bounds are within one histogram bin
+    of the exact bounds.  Approximate HPD intervals always contain at
+    least 1-alpha of the mass, and are at most two bins wider than the
+    exact HPD interval.
+
+    Parameters:
+    - - - - -
+    X: float, array
+        coefficient maps, shape (n_samples, n_components)
+    alpha: float
+        bounds contain 1-alpha of the mass of each component
+    method: str
+        'hpd': highest posterior density (shortest) interval
+        'percentile': equal-tailed interval
+    approximate: bool
+        use histogram approximation instead of sorting
+    n_bins: int
+        number of histogram bins per component, if approximate
+
+    Returns:
+    - - - -
+    lower: float, array
+        lower bound of each component, shape (n_components,)
+    upper: float, array
+        upper bound of each component, shape (n_components,)
+    error: float, array
+        error bound of each component, shape (n_components,)
+        'percentile': maximum absolute error of each bound
+        'hpd': maximum excess width of the interval
+        zero for exact bounds
+    """
+
+    X = np.asarray(X)
+    n_components = X.shape[1]
+
+    if method not in ['hpd', 'percentile']:
+        raise ValueError("method must be 'hpd' or 'percentile'. "
+                         "You provided %s." % str(method))
+
+    if not approximate:
+
+        error = np.zeros((n_components,))
+
+        if method == 'percentile':
+            lower, upper = np.percentile(X, [50.*alpha, 100.*(1-alpha/2.)], axis=0)
+            return lower, upper, error
+
+        n_samples = X.shape[0]
+        n_inside = int(np.ceil((1-alpha)*n_samples))
+
+        X = np.sort(X, axis=0)
+        widths = X[n_inside-1:] - X[:n_samples-n_inside+1]
+        start = np.argmin(widths, axis=0)
+
+        columns = np.arange(n_components)
+        return X[start, columns], X[start+n_inside-1, columns], error
+
+    edges, cdf = _histogram_cdf(X, n_bins)
+    error = edges[1] - edges[0]
+    columns = np.arange(n_components)
+
+    if method == 'percentile':
+        lower = np.argmax(cdf >= alpha/2., axis=0)
+        upper = np.argmax(cdf >= 1-alpha/2., axis=0)
+        return edges[lower, columns], edges[upper, columns], error
+
+    # for each starting edge, find the first end edge enclosing 1-alpha of the
+    # mass.  Offsetting column c by 2c makes the stacked cdfs globally sorted,
+    # so all columns are searched at once.
+    offsets = 2.*columns
+    stacked = (cdf + offsets).T.ravel()
+    targets = cdf + (1-alpha) + offsets
+    end = np.searchsorted(stacked, targets.T.ravel(), side='left')
+    end = end.reshape(n_components, n_bins+1).T - (n_bins+1)*columns
+
+    start = np.arange(n_bins+1)[:, np.newaxis]
+    widths = np.where(end <= n_bins, end - start, n_bins+1)
+
+    start = np.argmin(widths, axis=0)
+    end = end[start, columns]
+
+    return edges[start, columns], edges[end, columns], 2*error
+
+
+def _histogram_cdf(X, n_bins):
+
+    """
+    Histogram every column of X in a single pass.
+
+    Returns:
+    - - - -
+    edges: float, array
+        bin edges of each column, shape (n_bins+1, n_components)
+    cdf: float, array
+        fraction of each column below each edge, shape (n_bins+1, n_components)
+    """
+
+    n_samples, n_components = X.shape
+
+    minimum = X.min(axis=0)
+    width = (X.max(axis=0) - minimum) / n_bins
+    width[width == 0] = 1
+
+    bins = ((X - minimum) / width).astype(np.intp)
+    np.clip(bins, 0, n_bins-1, out=bins)
+    bins += n_bins*np.arange(n_components)
+
+    counts = np.bincount(bins.ravel(), minlength=n_bins*n_components)
+    counts = counts.reshape(n_components, n_bins).T
+
+    cdf = np.zeros((n_bins+1, n_components))
+    np.cumsum(counts, axis=0, out=cdf[1:])
+    cdf /= n_samples
+
+    edges = minimum + width*np.arange(n_bins+1)[:, np.newaxis]
+
+    return edges, cdf
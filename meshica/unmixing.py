@@ -0,0 +1,112 @@
+from operator import itemgetter
+
+import numpy as np
+from scipy.linalg import svd
+from sklearn.decomposition import fastica
+from sklearn.utils import check_random_state
+
+from joblib import delayed, Parallel
+
+from .instrumentation import FitStats
+from .parallel import blas_threads_per_worker, call_with_blas_limit
+
+
+def whiten(X):
+
+    """
+    Center and whiten data prior to FastICA.
+
+    Matches the whitening applied by
+    ``fastica(X, whiten='arbitrary-variance')``, so that FastICA can be
+    restarted on the result with ``whiten=False``.
+
+    Parameters:
+    - - - - -
+    X: float, array
+        data matrix, shape (n_samples, n_features)
+
+    Returns:
+    - - - -
+    X_white: float, array
+        whitened data, shape (n_samples, n_features)
+    """
+
+    X = np.asarray(X, dtype=np.float64)
+    n_samples = X.shape[0]
+
+    XT = X.T - X.mean(axis=0)[:, np.newaxis]
+    u, d, _ = svd(XT, full_matrices=False)
+    K = (u / d).T
+
+    X_white = np.dot(K, XT)
+    X_white *= np.sqrt(n_samples)
+
+    return X_white.T
+
+
+def fastica_restarts(X, n_init=10, random_state=None, n_jobs=4, backend=None,
+                     blas_threads=None, dtype=np.float64, stats=None):
+
+    """
+    Run FastICA from several random initializations, and keep the
+    sparsest solution.
+
+    The data is whitened once, and each restart only runs the FastICA
+    rotation on the shared, whitened matrix.  The whitened matrix is
+    passed to worker processes as a memory map rather than pickled for
+    each restart.
+
+    Parameters:
+    - - - - -
+    X: float, array
+        data matrix, shape (n_samples, n_features)
+    n_init: int
+        number of times FastICA is restarted
+    random_state: int, or RandomState
+        random number generator used to seed the restarts
+    n_jobs: int
+        number of restarts run in parallel
+    backend: str
+        joblib parallel backend (e.g. 'loky', 'threading')
+        default: None (joblib default)
+    blas_threads: int
+        BLAS threads per restart
+        default: None (divide the available cores between restarts)
+    dtype: numpy dtype
+        floating point precision of the returned components
+        whitening and the FastICA rotations are always computed in
+        float64: the whitened matrix is small, and the 'cube' iterations
+        can diverge in float32
+    stats: FitStats
+        records the time spent whitening and in the FastICA restarts
+        default: None (not recorded)
+
+    Returns:
+    - - - -
+    ica_maps: float, array
+        independent components, shape (n_features, n_samples)
+    """
+
+    random_state = check_random_state(random_state)
+    seeds = random_state.randint(np.iinfo(np.int32).max, size=n_init)
+
+    if stats is None:
+        stats = FitStats()
+
+    with stats.stage('whiten'):
+        X_white = whiten(X)
+
+    blas_threads = blas_threads_per_worker(n_jobs, blas_threads)
+
+    with stats.stage('fastica'):
+        results = Parallel(n_jobs=n_jobs, backend=backend, max_nbytes=0, mmap_mode='r')(
+            delayed(call_with_blas_limit)(blas_threads, fastica, X_white, whiten=False,
+                                          fun='cube', random_state=seed) for seed in seeds)
+
+    ica_maps_gen_ = (result[2].T for result in results)
+    ica_maps_and_sparsities = ((ica_map,
+                                np.sum(np.abs(ica_map), axis=1).max())
+                               for ica_map in ica_maps_gen_)
+    ica_maps, _ = min(ica_maps_and_sparsities, key=itemgetter(-1))
+
+    return ica_maps.astype(dtype, copy=False)
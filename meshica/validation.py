@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+
+def screen(matrix, chunk_size=4096):
+
+    """
+    Validate a subject matrix in a single pass over blocks of rows.
+
+    Non-finite values, all-zero rows and basic moments are computed
+    together for each block, so that only block-sized temporaries are
+    created.
+
+    Parameters:
+    - - - - -
+    matrix: float, array
+        subject matrix, shape (n_vertices, n_timepoints)
+    chunk_size: int
+        number of rows processed at a time
+
+    Returns:
+    - - - -
+    report: dict
+        'nans', 'infs': number of NaN and Inf values
+        'zero_rows': number of all-zero rows
+        'mean', 'std', 'min', 'max': moments of the finite values
+    zeros: bool, array
+        all-zero rows, shape (n_vertices,)
+    """
+
+    n_rows = matrix.shape[0]
+    zeros = np.zeros((n_rows,), dtype=bool)
+
+    nans = infs = n_finite = 0
+    total = squares = 0.
+    minimum, maximum = np.inf, -np.inf
+
+    for start in range(0, n_rows, chunk_size):
+
+        block = np.asarray(matrix[start:start+chunk_size])
+        zeros[start:start+block.shape[0]] = ~block.any(axis=1)
+
+        finite = np.isfinite(block)
+        n_block = finite.sum()
+
+        if n_block < block.size:
+            block_nans = np.isnan(block).sum()
+            nans += block_nans
+            infs += block.size - n_block - block_nans
+            block = block[finite]
+
+        if n_block > 0:
+            block = block.astype(np.float64, copy=False)
+            n_finite += n_block
+            total += block.sum()
+            squares += np.vdot(block, block)
+            minimum = min(minimum, block.min())
+            maximum = max(maximum, block.max())
+
+    mean = total / n_finite if n_finite else np.nan
+    std = np.sqrt(max(squares / n_finite - mean**2, 0.)) if n_finite else np.nan
+
+    report = {'nans': int(nans),
+              'infs': int(infs),
+              'zero_rows': int(zeros.sum()),
+              'mean': float(mean),
+              'std': float(std),
+              'min': float(minimum),
+              'max': float(maximum)}
+
+    return report, zeros
+
+
+class Quarantine(object):
+
+    def __init__(self, manifest):
+
+        """
+        Machine-readable record of subjects excluded from analysis.
+
+        Subjects are stored in a JSON manifest with their screening report
+        and the reason for exclusion, so that later runs can skip them
+        without loading them again.
+
+        Parameters:
+        - - - - -
+        manifest: str
+            JSON file of quarantined subjects
+            existing entries are loaded if the file exists
+        """
+
+        self.manifest = manifest
+        self.subjects = {}
+        self._lock = threading.Lock()
+
+        if os.path.isfile(manifest):
+            with open(manifest, 'r') as f:
+                self.subjects = json.load(f)
+
+    def __contains__(self, subject):
+
+        return subject in self.subjects
+
+    def add(self, subject, report, reason):
+
+        """
+        Quarantine a subject.
+
+        Parameters:
+        - - - - -
+        subject: str
+            subject file
+        report: dict
+            screening report of the subject
+        reason: str
+            reason for exclusion
+        """
+
+        entry = dict(report)
+        entry['reason'] = reason
+
+        with self._lock:
+            self.subjects[subject] = entry
+
+    def save(self):
+
+        """
+        Write the manifest to disk.
+        """
+
+        temp_manifest = self.manifest + '.tmp'
+
+        with self._lock:
+            with open(temp_manifest, 'w') as f:
+                json.dump(self.subjects, f, indent=2, sort_keys=True)
+
+        os.replace(temp_manifest, self.manifest)
+
+
+def as_quarantine(quarantine):
+
+    """
+    Convert an estimator's ``quarantine`` argument to a Quarantine.
+
+    Parameters:
+    - - - - -
+    quarantine: None, str, or Quarantine
+        no manifest, manifest file, or existing Quarantine
+
+    Returns:
+    - - - -
+    quarantine: Quarantine, or None
+    """
+
+    if quarantine is None or isinstance(quarantine, Quarantine):
+        return quarantine
+    return Quarantine(quarantine)
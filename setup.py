@@ -56,6 +56,9 @@ setup(
             ]
         },
     install_requires=requirements,
+    extras_require={
+        'hdf5': ['h5py'],
+    },
     license="BSD (3-clause)",
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',